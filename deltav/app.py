@@ -29,6 +29,7 @@ class DeltaVApp(pyglet.app.EventLoop):
         self.gameserver = GameServer()
         self.gameclient = GameClient(self.gameserver)
         self.gameclient.connect()
+        self.gameclient.subscribe()
         view = GameView(client=self.gameclient)
         self.window.set_view(view)
         # Schedule the event loop to trigger updates in the window each tick.
@@ -1,5 +1,6 @@
 
 import logging
+import os
 
 logger = logging.getLogger("delta-v")
 logger.setLevel(logging.DEBUG)
@@ -12,4 +13,13 @@ DEBUG=True
 
 MAIN_WINDOW_TITLE="delta-v"
 
-POSIX_DATA_DIR = '~/.chicken-mover/delta-v'
\ No newline at end of file
+POSIX_DATA_DIR = '~/.chicken-mover/delta-v'
+
+# Float type for the physics core: "longdouble", "float64" or "float32". It is
+# read once, when deltav.physics.helpers is first imported, and can be
+# overridden with the DELTAV_PRECISION environment variable. longdouble is the
+# reference; see deltav.physics.drift for how far the others wander off.
+PHYSICS_PRECISION = os.environ.get("DELTAV_PRECISION", "longdouble")
+
+# Positions handed to the renderer don't need to be any better than this.
+RENDER_PRECISION = "float32"
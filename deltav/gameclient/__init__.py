@@ -1,4 +1,7 @@
 
+from deltav.gameserver.snapshot import SnapshotReader
+
+
 class ConnectionError(Exception):
 
     def __init__(self, code, msg):
@@ -15,6 +18,7 @@ class GameClient(object):
         self.uid = "" # Generate a unique ID, store it locally, but allow the player to regenerate it?
         self.ship = None
         self.server = server
+        self.snapshots = None
 
     def connect(self, server):
         # Connect to server, get ship proxy for commands
@@ -25,9 +29,18 @@ class GameClient(object):
         else:
             raise ConnectionError(err, msg)
 
+    def subscribe(self):
+        # Read the scene from a snapshot channel from now on, rather than
+        # asking the server for it every time
+        self.snapshots = SnapshotReader(self.server.subscribe(self))
+
     def get_scene_info(self):
-        # For use by the ship nav and the UI
-        return self.server.get_scene_info()
+        # For use by the ship nav and the UI. The same either way (see
+        # deltav.gameserver.snapshot.scene_info), but debug info only comes
+        # from asking the server
+        if self.snapshots is not None:
+            return self.snapshots.read()
+        return self.server.get_scene_info(self)
 
     def get_ship_info(self):
         # For use by the ship nav and the UI
@@ -6,6 +6,7 @@ from multiprocessing.managers import BaseManager
 
 
 from deltav.gameserver.gamestate import GameState
+from deltav.gameserver.snapshot import SnapshotWriter, scene_info, objects_array
 from deltav.maps.earth import EarthMoonSystem
 
 class GameServer(object):
@@ -16,7 +17,10 @@ class GameServer(object):
 
         map_ = EarthMoonSystem()
         self.gamestate = GameState(map_)
+        self.gamestate.on_frame = self.publish
 
+        # Snapshot channels of subscribed clients: [(SnapshotWriter, ship)]
+        self.channels = []
 
     def connect(self, client):
         if self.can_connect(client):
@@ -29,13 +33,28 @@ class GameServer(object):
         return True # Auth here later
 
     def get_scene_info(self, client):
-        return {
-            "game_time": self.gamestate.current_time,
-            # FIXME: filter out objects the current player can't see?
-            # Thisis not the final data format
-            "objects": self.gamestate.get_visible_objects(client.ship),
-            "debug": self.gamestate.simulation_clock.info if self.debug else {},
-        }
+        return scene_info(
+            self.gamestate.current_time,
+            objects_array(self.gamestate.get_visible_objects(client.ship)),
+            dict(
+                self.gamestate.simulation_clock.info,
+                scheduler=self.gamestate.scheduler.info,
+            ) if self.debug else {},
+        )
+
+    def subscribe(self, client):
+        """
+        Open a snapshot channel for *client*, and return its name, for a
+        SnapshotReader. What the client can see is published on it every
+        frame from then on.
+        """
+        writer = SnapshotWriter()
+        self.channels.append((writer, client.ship))
+        return writer.name
+
+    def publish(self):
+        for writer, ship in list(self.channels):
+            writer.write(self.gamestate.current_time, self.gamestate.get_visible_objects(ship))
 
     def run(self):
         self.thread = threading.Thread(target=self.gamestate.runforever)
@@ -60,5 +79,5 @@ if __name__ == "__main__":
     server = GameServer(True)
     server.run()
     while True:
-        print(server.gamestate.current_time, len([i for i in server.gamestate.scene]), repr(server.gamestate.simulation_clock))
+        print(server.gamestate.current_time, len([i for i in server.gamestate.scene]), repr(server.gamestate.simulation_clock), repr(server.gamestate.scheduler))
         time.sleep(1)
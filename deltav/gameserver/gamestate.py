@@ -10,24 +10,23 @@ import pyglet
 import flamegraph
 
 
+from numpy import asarray
 from numpy.linalg import norm
 
 from deltav.ships import MobShip, PlayerShip, Bullet, Debris
 from deltav.physics.body import Body
-from deltav.physics.helpers import distance
+from deltav.physics.helpers import distance, _render_float
 from deltav.physics.util import load_tle_file
 from deltav.physics.orbit import Orbit
 from deltav.gameserver.util import DebugClock
+from deltav.gameserver.scheduler import Scheduler
+from deltav.configure import logger
 
 
 class GameState(object):
 
-    GAME_TIME_TICK = 1
-
     def __init__(self, map_):
 
-        self.speed = 1000
-
         self.paused = False
 
         self.scene = map_ # dunno
@@ -35,6 +34,31 @@ class GameState(object):
         
         self.current_time = 0.0
         self.simulation_clock = DebugClock()
+        self.scheduler = Scheduler(self.step)
+
+        # Game seconds per wall second
+        self.speed = 1000
+        # Step from event to event rather than at a fixed rate
+        self.jump_ahead = False
+        # Called after every wake-up that moved the scene on, e.g. to
+        # publish it to clients
+        self.on_frame = None
+
+    @property
+    def speed(self):
+        return self.scheduler.warp
+
+    @speed.setter
+    def speed(self, speed):
+        self.scheduler.warp = speed
+
+    @property
+    def jump_ahead(self):
+        return self.scheduler.events is not None
+
+    @jump_ahead.setter
+    def jump_ahead(self, jump_ahead):
+        self.scheduler.events = self.scene.next_event if jump_ahead else None
 
     def load_player(self, client):
         # Create a ship for the client, or reconnect to their old one, and add
@@ -52,29 +76,50 @@ class GameState(object):
             retval.append({
                 "tracking_id": obj2.tracking_id,
                 "transponder": obj2.transponder,
-                "position": obj2.get_position(),
+                "position": asarray(obj2.get_position(), dtype=_render_float),
             })
         return retval
 
-    def tick(self):
+    def step(self, gt):
+        """
+        Advance the scene by *gt* game seconds.
+        """
         try:
             self.simulation_clock.start_timer()
-            self.current_time += self.GAME_TIME_TICK
+            self.current_time += gt
 
-            self.scene.tick(self.GAME_TIME_TICK)
+            self.scene.tick(gt)
 
-            t = self.simulation_clock.record_time()
-
-            # Sleep for the rest of this game tick
-            t_wait = (1/(10*self.speed)) - t
-            if t_wait > .001:
-                time.sleep(t_wait)
-            else:
-                time.sleep(.001)
+            self.simulation_clock.record_time()
 
         finally:
             self.simulation_clock.clear_timer()
 
+    def advance(self, seconds):
+        """
+        Skip *seconds* of game time ahead now, rather than at the game's
+        speed. Only takes as many steps as there are events on the way with
+        jump_ahead on.
+        """
+        self.scheduler.advance(seconds)
+        self._frame()
+
+    def tick(self):
+        # Run whatever steps are due, hand the frame on if the scene moved,
+        # then sleep for the rest of the frame
+        if self.scheduler.update():
+            self._frame()
+        self.scheduler.wait()
+
+    def _frame(self):
+        # Whatever goes wrong handing the frame on, the simulation carries on
+        if self.on_frame is None:
+            return
+        try:
+            self.on_frame()
+        except Exception:
+            logger.exception("Error publishing frame at %s", self.current_time)
+
 
     def runforever(self):
         # flamegraph.start_profile_thread(fd=open("./perf.log", "w"))
@@ -85,4 +130,5 @@ class GameState(object):
             if not self.paused:
                 self.tick()
             else:
+                self.scheduler.reset()
                 time.sleep(.1) # Don't nuke the CPU
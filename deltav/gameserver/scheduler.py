@@ -0,0 +1,165 @@
+"""
+Fixed timestep scheduling for the simulation loop.
+
+The scene is always advanced in whole steps of game time, however long the
+loop actually slept: wall time since the last wake-up is turned into game
+time (times the warp factor) and added to an accumulator, and as many steps
+as fit are run. So game time keeps pace with the wall clock at any warp,
+and the sleep granularity only decides how many steps are run per wake-up.
+
+The step grows with the warp (in powers of two from MIN_STEP, so game time
+stays exact), keeping the number of steps per wake-up around
+STEPS_PER_FRAME. When the scene can't keep up, the backlog is capped at
+MAX_LAG seconds worth of game time, and whatever is over that is dropped
+and counted, rather than letting the loop spiral.
+
+With *events* given (usually BaseScene.next_event), the steps aren't fixed:
+each one jumps straight to the next event, or to as much game time as is
+due, whichever comes first. Then high warps cost as many steps as there are
+events rather than one per MAX_STEP, and advance() can skip hours of game
+time in one call.
+"""
+
+import time
+
+
+class Scheduler(object):
+    """
+    Calls *step_function(game_seconds)* on a fixed timestep, *warp* game
+    seconds per wall second. Call update() every time the loop wakes up and
+    wait() to sleep until the next frame.
+    """
+
+    MIN_STEP = 1
+    MAX_STEP = 64
+    # Wall seconds between wake-ups
+    FRAME = 0.01
+    STEPS_PER_FRAME = 4
+    # Wall seconds of backlog to keep before dropping game time
+    MAX_LAG = 0.25
+
+    def __init__(self, step_function, warp = 1, clock = time.monotonic,
+                 sleep = time.sleep, on_overrun = None, events = None):
+        self.step_function = step_function
+        # Called with the game seconds due, returns how far the next step
+        # can go; None for fixed steps
+        self.events = events
+        self.clock = clock
+        self._sleep = sleep
+        # Called with the number of game seconds dropped, if any
+        self.on_overrun = on_overrun
+
+        self.game_time = 0
+        self.accumulator = 0
+        self.steps = 0
+        self.overruns = 0
+        self.dropped = 0
+        # Share of wall time spent stepping (running average)
+        self.load = 0
+        self._last = None
+        self.warp = warp
+
+    @property
+    def warp(self):
+        return self._warp
+
+    @warp.setter
+    def warp(self, warp):
+        self._warp = warp
+        step = self.MIN_STEP
+        while step < self.MAX_STEP and warp * self.FRAME > step * self.STEPS_PER_FRAME:
+            step *= 2
+        self.step = step
+
+    @property
+    def info(self):
+        return {
+            "warp": self.warp,
+            "step": self.step,
+            "steps": self.steps,
+            "backlog": self.accumulator,
+            "overruns": self.overruns,
+            "dropped": self.dropped,
+            "load": self.load,
+            "jump": self.events is not None,
+        }
+
+    def __repr__(self):
+        return "<Scheduler: %(warp)sx step=%(step)s load=%(load).2f dropped=%(dropped)s>" % self.info
+
+    def reset(self):
+        """
+        Forget the last wake-up, e.g. after a pause, so the time spent
+        paused isn't caught up on.
+        """
+        self._last = None
+        self.accumulator = 0
+
+    def update(self):
+        """
+        Run every whole step that is due. Gives up for this wake-up once a
+        frame's worth of wall time has gone on stepping. Returns the number
+        of steps run.
+        """
+        now = self.clock()
+        if self._last is None:
+            self._last = now
+        elapsed = now - self._last
+        self._last = now
+        self.accumulator += elapsed * self.warp
+
+        steps = self.steps
+        self.accumulator = self._run(self.accumulator, now + self.FRAME)
+        steps = self.steps - steps
+
+        busy = self.clock() - now
+        if elapsed > 0:
+            self.load += (min(busy / elapsed, 10) - self.load) / 10
+
+        limit = max(self.MAX_LAG * self.warp, self.step)
+        if self.accumulator > limit:
+            dropped = self.accumulator - limit
+            self.accumulator = limit
+            self.overruns += 1
+            self.dropped += dropped
+            if self.on_overrun is not None:
+                self.on_overrun(dropped)
+        return steps
+
+    def advance(self, seconds):
+        """
+        Run *seconds* of game time straight away, whatever the clock says.
+        Returns the game seconds left over (less than one step).
+        """
+        return self._run(seconds)
+
+    def _run(self, due, deadline = None):
+        """
+        Step through as much of *due* game seconds as whole steps allow,
+        giving up once the clock passes *deadline*. Returns what is left.
+        """
+        smallest = self.step if self.events is None else self.MIN_STEP
+        while due >= smallest:
+            step = self.step if self.events is None else self._jump(due)
+            self.step_function(step)
+            due -= step
+            self.game_time += step
+            self.steps += 1
+            if deadline is not None and self.clock() > deadline:
+                break
+        return due
+
+    def _jump(self, due):
+        """
+        Whole MIN_STEPs up to the next event, or all that is due.
+        """
+        step = min(self.events(due), due)
+        return max(int(step // self.MIN_STEP), 1) * self.MIN_STEP
+
+    def wait(self):
+        """
+        Sleep until the next frame is due.
+        """
+        remaining = self._last + self.FRAME - self.clock()
+        if remaining > 0:
+            self._sleep(remaining)
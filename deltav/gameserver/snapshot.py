@@ -0,0 +1,229 @@
+"""
+Scene snapshots over shared memory.
+
+The server writes what a client can see into a SnapshotWriter once a frame,
+and the client reads the latest whole frame with a SnapshotReader straight
+out of shared memory: no round trip to the server, and nothing pickled. Only
+the channel's name goes through the manager, once, when subscribing.
+
+A channel is one shared memory block holding a header and two frame slots.
+The writer fills whichever slot the latest frame isn't in, and only then
+bumps the sequence number in the header, so the latest frame is never
+written over while it is the latest. Each slot is stamped with the sequence
+number of its frame before and after the objects are written; if a reader
+finds the stamps changed under it (the writer got two frames ahead during
+the copy), it reads again.
+
+When a frame doesn't fit, the writer moves to a block twice the size and
+leaves its name in the old block's header for readers to follow.
+"""
+
+import weakref
+
+from multiprocessing.shared_memory import SharedMemory
+
+from numpy import dtype, int64, float64, uint8, zeros
+
+from deltav.physics.helpers import _render_float
+from deltav.physics.parallel import _array, _let_go
+
+
+HEADER = dtype([
+    ("sequence", int64),
+    ("capacity", int64),
+    # Name of the block the channel moved to, if it did
+    ("moved", "S64"),
+])
+
+SLOT = dtype([
+    ("begin", int64),
+    ("end", int64),
+    ("game_time", float64),
+    ("count", int64),
+])
+
+# One visible object in a frame
+OBJECT = dtype([
+    ("tracking_id", "U8"),
+    ("name", "U32"),
+    ("flag", "U8"),
+    ("position", _render_float, (3,)),
+])
+
+
+class SnapshotWriter(object):
+    """
+    Server end of a snapshot channel, with room for *capacity* objects a
+    frame to start with. Hand name to a SnapshotReader.
+    """
+
+    def __init__(self, capacity = 256):
+        self.sequence = 0
+        # Every block this channel has used; readers may still be on an
+        # old one, so they are only unlinked on close()
+        self._blocks = []
+        self._finalizer = weakref.finalize(self, _release, self._blocks)
+        self._open(capacity)
+
+    @property
+    def name(self):
+        return self._blocks[0].name
+
+    def _open(self, capacity):
+        block = SharedMemory(create=True, size=_size(capacity))
+        self._blocks.append(block)
+        self.capacity = capacity
+        self._header, self._slots, self._objects = _views(block, capacity)
+        self._header["sequence"] = self.sequence
+
+    def write(self, game_time, objects):
+        """
+        Publish a frame. *objects* is a list of dicts, as from
+        GameState.get_visible_objects().
+        """
+        count = len(objects)
+        if count > self.capacity:
+            old = self._header
+            capacity = self.capacity
+            while capacity < count:
+                capacity *= 2
+            self._open(capacity)
+            old["moved"] = self._blocks[-1].name.encode()
+
+        sequence = self.sequence + 1
+        i = sequence % 2
+        slot = self._slots[i:i + 1]
+        slot["begin"] = sequence
+        slot["game_time"] = game_time
+        slot["count"] = count
+        _fill(self._objects[i, :count], objects)
+        slot["end"] = sequence
+
+        self._header["sequence"] = self.sequence = sequence
+
+    def close(self):
+        self._finalizer()
+
+
+class SnapshotReader(object):
+    """
+    Client end of the snapshot channel called *name*.
+    """
+
+    def __init__(self, name):
+        self._finalizer = None
+        self._attach(name)
+        # Sequence number of the frame last read; 0 before the first one
+        self.sequence = 0
+        self._frame = scene_info(0.0, zeros(0, dtype=OBJECT))
+
+    def _attach(self, name):
+        try:
+            block = SharedMemory(name, track=False)
+        except TypeError:
+            # Before Python 3.13, attaching registers the block with this
+            # process's resource tracker too, which may unlink it when this
+            # process exits (see _release).
+            block = SharedMemory(name)
+        self._header, self._slots, self._objects = _views(block)
+        if self._finalizer is not None:
+            self._finalizer()
+        self._finalizer = weakref.finalize(self, _let_go, block)
+
+    def read(self):
+        """
+        The latest whole frame, as scene_info(). Until the first one is
+        published, that is an empty scene at time 0. The same frame is
+        returned until there's a new one.
+        """
+        while True:
+            moved = self._header["moved"][0]
+            if moved:
+                self._attach(moved.decode())
+                continue
+
+            sequence = int(self._header["sequence"][0])
+            if sequence == self.sequence:
+                return self._frame
+
+            i = sequence % 2
+            slot = self._slots[i]
+            if slot["end"] != sequence:
+                continue
+            game_time = float(slot["game_time"])
+            objects = self._objects[i, :slot["count"]].copy()
+            if self._slots[i]["begin"] != sequence:
+                continue
+
+            self.sequence = sequence
+            self._frame = scene_info(game_time, objects)
+            return self._frame
+
+    def close(self):
+        self._finalizer()
+
+
+def scene_info(game_time, objects, debug = None):
+    """
+    What GameClient.get_scene_info() returns, whichever way it came: *objects*
+    is an OBJECT array. Debug info only comes from asking the server.
+    """
+    return {
+        "game_time": game_time,
+        "objects": objects,
+        "debug": debug or {},
+    }
+
+
+def objects_array(objects):
+    """
+    OBJECT array of *objects*, a list of dicts as from
+    GameState.get_visible_objects().
+    """
+    records = zeros(len(objects), dtype=OBJECT)
+    _fill(records, objects)
+    return records
+
+
+def _fill(records, objects):
+    if not len(objects):
+        return
+    records["tracking_id"] = [obj["tracking_id"] for obj in objects]
+    records["name"] = [obj["transponder"].get("name", "") for obj in objects]
+    records["flag"] = [obj["transponder"].get("flag", "") for obj in objects]
+    records["position"] = [obj["position"] for obj in objects]
+
+
+def _size(capacity):
+    return HEADER.itemsize + 2 * SLOT.itemsize + 2 * capacity * OBJECT.itemsize
+
+
+def _views(block, capacity = None):
+    """
+    (header, slots, objects) arrays over a channel *block*. The capacity
+    is read from the header, unless given (for a new block).
+    """
+    memory = _array(block, (block.size,), uint8)
+    header = memory[:HEADER.itemsize].view(HEADER)
+    if capacity is None:
+        capacity = int(header["capacity"][0])
+    else:
+        header["capacity"] = capacity
+
+    start = HEADER.itemsize
+    end = start + 2 * SLOT.itemsize
+    slots = memory[start:end].view(SLOT)
+    start, end = end, end + 2 * capacity * OBJECT.itemsize
+    objects = memory[start:end].view(OBJECT).reshape(2, capacity)
+    return header, slots, objects
+
+
+def _release(blocks):
+    for block in blocks:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            # A reader's resource tracker got to it first
+            pass
+        _let_go(block)
+    del blocks[:]
@@ -14,13 +14,16 @@ def spheres_collide(p1, p2, r1, r2):
     return (dx**2 + dy**2 + dz**2) < radii**2
 
 def line_intersects_sphere(line_p1, line_p2, sphere_p, sphere_r):
+    """
+    True if the line segment from *line_p1* to *line_p2* passes through the
+    sphere (e.g. a planet in the line of sight between two ships).
+    """
     x1, y1, z1 = line_p1
     x2, y2, z2 = line_p2
     x3, y3, z3 = sphere_p
-    r = sphere_r
-    # http://paulbourke.net/geometry/circlesphere/index.html#linesphere
-    a = (x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2
-    b = 2*( (x2 - x1) (x1 - x3) + (y2 - y1) (y1 - y3) + (z2 - z1) (z1 - z3) )
-    c = x3**2 + y3**2 + z3**2 + x1**2 + y1**2 + z1**2 - 2(x3*x1 + y3*y1 + z3Üz1) - r**2 
-    disc = b**2 - 4*a*c
-    return disc >= 0
\ No newline at end of file
+    dx, dy, dz = x2 - x1, y2 - y1, z2 - z1
+    fx, fy, fz = x1 - x3, y1 - y3, z1 - z3
+    # Closest point of the segment to the centre, as a fraction along it
+    a = dx**2 + dy**2 + dz**2
+    t = 0 if a == 0 else min(max(-(fx*dx + fy*dy + fz*dz) / a, 0), 1)
+    return (fx + t*dx)**2 + (fy + t*dy)**2 + (fz + t*dz)**2 < sphere_r**2
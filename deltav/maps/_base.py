@@ -1,35 +1,76 @@
+from numpy import array, zeros, newaxis, minimum, maximum, sqrt, argsort, pi
+from numpy.linalg import norm
 
-from rtree import index
-
-from deltav.geometry import spheres_collide
+from deltav.geometry import spheres_collide, line_intersects_sphere
+from deltav.maps._store import SceneStore
+from deltav.maps.broadphase import SweepAndPruneBroadPhase
+from deltav.physics.approach import closest_approach
+from deltav.physics.batch import BatchPropagator
+from deltav.physics.conjunction import Screener
+from deltav.physics.helpers import _float
 from deltav.worldbuilding import random_ship_name
 
 class BaseScene(object):
     """
     Wrapper for getting information about the current scene.
 
-    Uses an RTree implementation internally that works on bounding boxes, rather
-    than points (we may find this more useful in the long run), and has the additional
-    advantage of not being of limited size.
+    Collision candidates come from a broad phase (see deltav.maps.broadphase)
+    that works on bounding boxes, rather than points (we may find this more
+    useful in the long run). Maps pick one with BROAD_PHASE; the default is a
+    sort-and-sweep over the whole scene, which needs no per-object queries.
 
     Further notes:
 
-    - Lots of deleting from the index is expensive, but we don't want it to grow too
-      large. So we add a flush() method that just dumps the index and builds a new one
-      every simulation iteration.
+    - Objects live in a columnar SceneStore (self.objects), and are known to
+      the broad phase by their store slot.
+
+    - With CONTINUOUS_COLLISIONS on, the broad phase gets swept boxes covering
+      each object's whole path over the last tick, and candidate pairs are
+      checked for their closest approach along those paths rather than only
+      at the end of the tick.
+
+    - Ticks don't have to be short. Between events every object is on a
+      conic, so tick() can take any number of seconds in one go: next_event()
+      says how far the scene can jump before something needs a tick of its
+      own (a torpedo correction, a predicted impact, leaving a sphere of
+      influence), or the paths get too curved for the collision checks. A
+      collision partway through a long tick cuts it short there (see
+      MIN_TICK), so it happens where it should, and the rest of the tick
+      follows.
     
     """
 
+    # Called with no arguments to make the scene's broad phase. Use a class, or
+    # a functools.partial to pass options (a plain function would be bound).
+    BROAD_PHASE = SweepAndPruneBroadPhase
+
+    # Called with no arguments to make the store's propagator, like
+    # BROAD_PHASE. A deltav.physics.parallel.SharedPropagator propagates on
+    # worker processes.
+    PROPAGATOR = BatchPropagator
+
+    # Check whole paths over each tick for collisions, not just end positions
+    CONTINUOUS_COLLISIONS = True
+
+    # Longest jump: the fastest turning object goes no further than this
+    # around its parent. Collisions are checked along cubic arcs, which stay
+    # within r*WARP_ANGLE**4/384 of the real path (10 m in GEO).
+    WARP_ANGLE = 2 * pi / 64
+
+    # Collisions more than this many seconds before the end of a tick cut it
+    # short; ones closer to the end happen at the end, as with fixed steps
+    MIN_TICK = 1
+
     def __init__(self):
-        self.objects = {}
+        self.objects = SceneStore(propagator=self.PROPAGATOR)
         self.bodies = set() # Treated differently because square boxes aren't good enough
-        self._ip = index.Property()
-        self._ip.dimension = 3
-        self._ip.leaf_capacity = 100
-        self._new_index()
+        self.broadphase = self.BROAD_PHASE()
+        # State of each slot at the start of the current tick
+        self._start_position = zeros((0, 3), dtype=_float)
+        self._start_velocity = zeros((0, 3), dtype=_float)
 
     def __iter__(self):
-        for j in list(self.objects.values()):
+        for j in list(self.objects):
             yield j
 
 
@@ -47,11 +88,11 @@ class BaseScene(object):
         # b) sphere approximations
         #
         # This isn't a permanent solution, though.
-        for obj2 in self.objects.values():
+        for obj2 in self.objects:
             if obj2.tracking_id != obj.tracking_id:
                 for body in self.bodies:
                     if line_intersects_sphere(
-                        obj1.get_position(),
+                        obj.get_position(),
                         obj2.get_position(),
                         body.get_position(),
                         body.radius
@@ -61,49 +102,189 @@ class BaseScene(object):
                     yield obj2
 
     def get_collisions(self, obj):
-        id_ = hash(obj.tracking_id)
-        box = self._get_box(obj)
-        for nearby in self.index.intersection(box):
-            if nearby != id_: # Don't collide with self
-                yield self.objects.get(nearby)
+        lo, hi = self._get_boxes([obj._slot])
+        for slot in self.broadphase.query(lo[0], hi[0]).tolist():
+            if slot != obj._slot: # Don't collide with self
+                yield self.objects.get(slot)
         # Check collision with any bodies
         for body in self.bodies:
             if spheres_collide(obj.get_position(), body.get_position(), obj.radius, body.radius):
                 yield body
 
     def tick(self, gt):
-        del self.index
-        self._new_index()
-        collisions = []
-        marked = []
+        while gt > 0:
+            gt -= self._tick(gt)
+
+    def _tick(self, gt):
+        """
+        Tick by *gt* seconds, or only up to just after the first collision
+        (see MIN_TICK). Returns the seconds ticked.
+        """
+        objects = list(self.objects)
+        self._save_start_state()
+        # The store is moved on first, on its own, to find the collisions:
+        # unlike the objects' game_tick(), that can be taken back.
+        self.objects.step(gt)
+        slots, _, _ = self.objects.propagate()  # Solve all new positions at once
+        self._update_broadphase(gt)             # Hand the new boxes over
+        collisions = self._collisions(gt)
 
-        for obj in self.objects.values():
+        if collisions and collisions[0][0] + self.MIN_TICK < gt:
+            end = collisions[0][0] + self.MIN_TICK
+            self.objects.step(end - gt)
+            slots, _, _ = self.objects.propagate()
+            self._update_broadphase(end)
+            collisions = [hit for hit in collisions if hit[0] <= end]
+            gt = end
+
+        for obj in objects:
             obj.game_tick(gt)               # Update epoch of orbit
-            box = self._get_box(obj)        # Get the new bounding box
-            id_ = hash(obj.tracking_id)
-            self.index.insert(id_, box)     # Add to index
-
-            #
-            # FIXME: one issue with this is that if gt is large, or objects are
-            #        moving very fast, we run the risk of missing collisions 
-            #        that happened between ticks. The solution is to draw the
-            #        bounding box to include intermediate points. The downside
-            #        of this is that it can create collisions in the "wake" of
-            #        objects, or in what should properly be near-misses. It may
-            #        also fail if the path of an object is very fast around a
-            #        perigee or apogee.
-            #
-            for obj2 in self.get_collisions(obj):
-                # Only moved objects have been added back to the index at this
-                # point, so we have no risk of colliding with an object in a
-                # stale position.
-                collisions.append((obj, obj2))
-
-        # Perform collisions, remove old objects, add new ones
-        for obj1, obj2 in collisions:
+        self._prime(slots)
+
+        # Perform collisions, remove old objects, add new ones. An object can
+        # only be destroyed once: if an earlier pair already took it out of the
+        # scene, later pairs with it don't happen.
+        for _, obj1, obj2 in collisions:
+            if self._gone(obj1) or self._gone(obj2):
+                continue
             new_debris = self.collide(obj1, obj2)
             self.add_all(*new_debris)
+        return gt
+
+    def _collisions(self, gt):
+        """
+        Everything that touched over the last tick (objects with each other,
+        and with bodies) as (t, obj1, obj2), in order of time t from the start
+        of the tick. Without continuous collisions, t is the end of the tick.
+        """
+        pairs, times = self._pair_hits(gt)
+        collisions = [
+            (t, self.objects.get(i), self.objects.get(j))
+            for t, (i, j) in zip(times.tolist(), pairs.tolist())
+        ]
+        collisions += self._body_collisions(gt)
+        collisions.sort(key=lambda hit: hit[0])
+        return collisions
+
+    def next_event(self, limit):
+        """
+        Game seconds the scene can be ticked by in one go, up to *limit*:
+        until the soonest event of any object (see Body.next_event), and no
+        further than WARP_ANGLE around the orbit for anything.
+        """
+        store = self.objects
+        slots = store.slots()
+        moving = slots[store.moving[slots]]
+        if len(moving):
+            rate = store.propagator.periapsis_rate(moving).max()
+            limit = min(limit, self.WARP_ANGLE / rate)
+        for obj in store:
+            event = obj.next_event()
+            if event is not None and event < limit:
+                limit = event
+        return limit
+
+    def conjunctions(self, horizon, distance, screener = None):
+        """
+        Yield (obj1, obj2, conjunction) for every time two objects will pass
+        within *distance* meters of each other in the next *horizon* seconds
+        (see deltav.physics.conjunction). Pass a Screener to reuse its
+        worker pool; otherwise one is started for the call.
+        """
+        objects = [obj for obj in self.objects if obj._orbit is not None]
+        own = screener is None
+        if own:
+            screener = Screener()
+        try:
+            orbits = [obj._orbit for obj in objects]
+            for conjunction in screener.run(orbits, horizon, distance):
+                yield objects[conjunction.first], objects[conjunction.second], conjunction
+        finally:
+            if own:
+                screener.shutdown(wait=False)
 
+    def collision_pairs(self, gt):
+        """
+        Every pair of objects that touched during the last tick, as an (M, 2)
+        array of store slots. Each pair appears once. With continuous
+        collisions on, pairs are in order of when they touched.
+
+        Broad phase: overlapping (swept) boxes. Narrow phase: closest approach
+        between the two arcs, or just the distance between the two objects at
+        the end of the tick without continuous collisions. Both are done for
+        all candidate pairs at once.
+        """
+        return self._pair_hits(gt)[0]
+
+    def _pair_hits(self, gt):
+        """
+        collision_pairs(), and when each pair touched, as an (M,) array.
+        """
+        store = self.objects
+        a, b = self.broadphase.pairs()
+        if not len(a):
+            return zeros((0, 2), dtype=int), zeros(0)
+
+        touch = (store.radius[a] + store.radius[b])/2
+        if self.CONTINUOUS_COLLISIONS:
+            t, distance = closest_approach(
+                self._start_position[a], self._start_velocity[a],
+                store.position[a], store.velocity[a],
+                self._start_position[b], self._start_velocity[b],
+                store.position[b], store.velocity[b],
+                gt, within=touch,
+            )
+            hit = (distance <= touch).nonzero()[0]
+            hit = hit[argsort(t[hit], kind="stable")]
+        else:
+            distance = norm(store.position[a] - store.position[b], axis=1)
+            hit = (distance <= touch).nonzero()[0]
+            t = zeros(len(a)) + gt
+
+        return array([a[hit], b[hit]]).T.reshape(-1, 2), t[hit].astype(float)
+
+    def _body_collisions(self, gt):
+        """
+        Objects whose path over the last tick touched one of the bodies, as
+        (t, obj, body), t being when (see _collisions). Bodies don't move relative to the frame we are working in, so they
+        are a fixed point with no velocity.
+        """
+        store = self.objects
+        slots = self.broadphase.slots
+        lo = self.broadphase.lo[slots]
+        hi = self.broadphase.hi[slots]
+
+        collisions = []
+        for body in self.bodies:
+            centre = array(body.get_position(), dtype=float)
+            # Only objects whose box gets near enough to the body
+            gap = maximum(maximum(lo - centre, centre - hi), 0)
+            near = (gap**2).sum(-1) < (store.radius[slots].astype(float) + body.radius)**2
+            near_slots = slots[near]
+            if not len(near_slots):
+                continue
+            if self.CONTINUOUS_COLLISIONS:
+                p = zeros((len(near_slots), 3), dtype=_float) + centre
+                v = zeros((len(near_slots), 3), dtype=_float)
+                t, distance = closest_approach(
+                    self._start_position[near_slots], self._start_velocity[near_slots],
+                    store.position[near_slots], store.velocity[near_slots],
+                    p, v, p, v,
+                    gt, within=store.radius[near_slots] + body.radius,
+                )
+            else:
+                distance = norm(store.position[near_slots] - centre, axis=1)
+                t = zeros(len(near_slots)) + gt
+            hit = distance < store.radius[near_slots] + body.radius
+            collisions += [
+                (float(t_hit), store.get(i), body)
+                for t_hit, i in zip(t[hit], near_slots[hit].tolist())
+            ]
+
+        return collisions
+
+    def _gone(self, obj):
+        return obj not in self.objects and obj not in self.bodies
 
     def collide(self, obj1, obj2):
         # FIXME: not all collisions should result in total obliteration
@@ -118,22 +299,86 @@ class BaseScene(object):
             self.remove(obj2)
         return debris
 
-    def _new_index(self):
-        self.index = index.Index(interleaved=False, properties=self._ip)
+    def _save_start_state(self):
+        self._fit_arrays()
+        slots = self.objects.slots()
+        self._start_position[slots] = self.objects.position[slots]
+        self._start_velocity[slots] = self.objects.velocity[slots]
+
+    def _prime(self, slots):
+        """
+        Hand the positions the store solved for *slots* to each orbit's cache,
+        so that get_position() calls for the rest of the tick are just
+        lookups. Orbits changed in game_tick() were synced into the store
+        again, so the store is up to date for those too.
+        """
+        store = self.objects
+        positions, velocities = store.position[slots], store.velocity[slots]
+        for slot, p, v in zip(slots.tolist(), positions, velocities):
+            orbit = store.get(slot)._orbit
+            if orbit is not None:
+                orbit.prime_position(p, v)
+
+    def _update_broadphase(self, gt):
+        """
+        Bring the broad phase up to date with the positions in the store.
+        """
+        slots = self.objects.slots()
+        self._fit_arrays()
+        if self.CONTINUOUS_COLLISIONS:
+            lo, hi = self._get_swept_boxes(slots, gt)
+        else:
+            lo, hi = self._get_boxes(slots)
+        travel = norm(self.objects.velocity[slots].astype(float), axis=1) * gt
+        self.broadphase.update(slots, lo, hi, travel)
+
+    def _fit_arrays(self):
+        capacity = self.objects.capacity
+        size = len(self._start_position)
+        if size == capacity:
+            return
+        for name in ("_start_position", "_start_velocity"):
+            column = getattr(self, name)
+            new = zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            new[:size] = column
+            setattr(self, name, new)
+
+    def _get_boxes(self, slots):
+        """
+        Tight bounding boxes for many slots at once, as (lo, hi) arrays.
+        """
+        position = self.objects.position[slots].astype(float)
+        r = (self.objects.radius[slots].astype(float)/2)[:, newaxis]
+        return position - r, position + r
+
+    def _get_swept_boxes(self, slots, gt):
+        """
+        Bounding boxes covering each slot's path over the last tick.
 
-    def _get_box(self, obj):
-        px, py, pz = obj.get_position()
-        r = obj.radius/2
-        box = (px-r, px+r, py-r, py+r, pz-r, pz+r)
-        return box
+        The box around the two end points is padded by the most the arc can
+        bow out from the straight line between them: a path with acceleration
+        no more than A stays within A*t**2/8 of its chord.
+        """
+        store = self.objects
+        start = self._start_position[slots].astype(float)
+        end = store.position[slots].astype(float)
+        r_min = sqrt(minimum((start**2).sum(-1), (end**2).sum(-1)))
+        mu = store.propagator.mu[slots].astype(float)
+        sagitta = mu / r_min**2 * gt**2 / 8
+        pad = (store.radius[slots].astype(float)/2 + sagitta)[:, newaxis]
+        return minimum(start, end) - pad, maximum(start, end) + pad
 
     def add(self, obj):
-        id_ = hash(obj.tracking_id)
-        self.objects[id_] = obj
+        slot = self.objects.add(obj)
+        # Objects added mid-tick start their path where they are now
+        self._fit_arrays()
+        self._start_position[slot] = self.objects.position[slot]
+        self._start_velocity[slot] = self.objects.velocity[slot]
 
     def remove(self, obj):
-        id_ = hash(obj.tracking_id)
-        self.objects.pop(id_, "")
+        if obj in self.objects:
+            self.broadphase.remove(obj._slot)
+        self.objects.remove(obj)
 
     def remove_all(self, *objs):
         for obj in objs:
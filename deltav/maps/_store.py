@@ -0,0 +1,149 @@
+"""
+Columnar storage for everything in a scene.
+
+Each object gets a stable integer slot when it is added. Per-object state
+lives in contiguous arrays indexed by slot, so scene-wide work (propagation,
+collision checks, exporting positions) can be done in batches. Body instances
+keep a reference to their slot and read/write through it.
+"""
+
+from numpy import zeros, flatnonzero
+
+from deltav.physics.helpers import _float
+from deltav.physics.batch import BatchPropagator
+
+
+class SceneStore(object):
+    """
+    Columns (all indexed by slot):
+
+        position, velocity  -- (N, 3) state at the current game time
+        radius              -- (N,)
+        kind                -- (N,) one of the deltav.physics.body KIND_* values
+        flags               -- (N,) bitwise OR of deltav.physics.body FLAG_* values
+        live                -- (N,) slot is in use
+        moving              -- (N,) slot has an orbit to propagate
+
+    Removed slots go on a free list and are handed out again by add().
+
+    *propagator* is called with no arguments to make the store's propagator
+    (a BatchPropagator, or a subclass such as
+    deltav.physics.parallel.SharedPropagator).
+    """
+
+    def __init__(self, capacity = 64, propagator = BatchPropagator):
+        self.capacity = 0
+        self.objects = []
+        self._free = []
+        self._high = 0 # first slot that has never been used
+        self.propagator = propagator()
+
+        self.position = zeros((0, 3), dtype=_float)
+        self.velocity = zeros((0, 3), dtype=_float)
+        self.radius = zeros(0, dtype=_float)
+        self.kind = zeros(0, dtype="i1")
+        self.flags = zeros(0, dtype="u1")
+        self.live = zeros(0, dtype=bool)
+        self.moving = zeros(0, dtype=bool)
+
+        self._grow(capacity)
+
+    def __len__(self):
+        return self._high - len(self._free)
+
+    def __iter__(self):
+        for slot in self.slots():
+            yield self.objects[slot]
+
+    def __contains__(self, obj):
+        slot = getattr(obj, "_slot", None)
+        return slot is not None and obj._store is self and self.objects[slot] is obj
+
+    def _grow(self, capacity):
+        for name in ("position", "velocity", "radius", "kind", "flags", "live", "moving"):
+            column = getattr(self, name)
+            new = zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            new[:self.capacity] = column
+            setattr(self, name, new)
+        self.objects.extend([None] * (capacity - self.capacity))
+        self.propagator.resize(capacity)
+        self.capacity = capacity
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        if self._high == self.capacity:
+            self._grow(max(self.capacity * 2, 1))
+        slot = self._high
+        self._high += 1
+        return slot
+
+    def slots(self):
+        """
+        Array of all slots currently in use, in ascending order.
+        """
+        return flatnonzero(self.live[:self._high])
+
+    def get(self, slot):
+        return self.objects[slot]
+
+    def add(self, obj):
+        if obj in self:
+            return obj._slot
+        slot = self._allocate()
+        self.objects[slot] = obj
+        self.live[slot] = True
+        self.kind[slot] = obj.kind
+        obj._attach(self, slot)
+        self.sync(obj)
+        return slot
+
+    def remove(self, obj):
+        if obj not in self:
+            return
+        slot = obj._slot
+        obj._detach()
+        self.objects[slot] = None
+        self.live[slot] = False
+        self.moving[slot] = False
+        self.flags[slot] = 0
+        self._free.append(slot)
+
+    def sync(self, obj):
+        """
+        Re-read everything the store keeps for *obj* from the object itself.
+        Needs to be called whenever the orbit is replaced or its epoch is
+        reset (Body takes care of this).
+        """
+        slot = obj._slot
+        self.radius[slot] = obj.radius
+        self.flags[slot] = obj._flags
+        orbit = obj._orbit
+        if orbit is not None:
+            self.propagator.set_orbit(slot, orbit)
+            self.position[slot], self.velocity[slot] = orbit.get_position()
+            self.moving[slot] = True
+        else:
+            self.position[slot] = 0
+            self.velocity[slot] = 0
+            self.moving[slot] = False
+
+    def step(self, delta_seconds):
+        self.propagator.step(delta_seconds)
+
+    def propagate(self):
+        """
+        Solve the current state of every moving object, and write it into the
+        position and velocity columns. Returns (slots, positions, velocities)
+        for the slots that were updated. Slots whose orbit couldn't be solved
+        are left out, and keep their last good state.
+        """
+        slots = flatnonzero(self.live[:self._high] & self.moving[:self._high])
+        positions, velocities, valid = self.propagator.propagate(rows=slots)
+        if not valid.all():
+            slots = slots[valid]
+            positions = positions[valid]
+            velocities = velocities[valid]
+        self.position[slots] = positions
+        self.velocity[slots] = velocities
+        return slots, positions, velocities
@@ -0,0 +1,393 @@
+"""
+Collision broad phases.
+
+A broad phase is handed an axis-aligned box for every object in the scene
+each tick, and answers "which pairs of boxes overlap?". Objects are known by
+their scene store slot. Each scene picks its implementation with
+BaseScene.BROAD_PHASE.
+
+Boxes are given as (lo, hi) arrays of shape (N, 3).
+"""
+
+from numpy import (
+    array, zeros, arange, full,
+    repeat, cumsum, diff, flatnonzero, concatenate,
+    argsort, unique, searchsorted,
+    floor, maximum, minimum, median, newaxis,
+)
+from numpy.linalg import norm
+from rtree import index
+
+
+class BroadPhase(object):
+    """
+    Base class. Keeps the latest box for each slot, and provides the exact
+    box test the implementations use to weed out false candidates.
+    """
+
+    def __init__(self):
+        self.lo = zeros((0, 3))
+        self.hi = zeros((0, 3))
+        self.live = zeros(0, dtype=bool)
+        self.slots = zeros(0, dtype=int)
+
+    def update(self, slots, lo, hi, travel):
+        """
+        Set the boxes for every slot in the scene. *travel* is how far each
+        slot moves in one tick, for implementations that want to pad boxes.
+        """
+        size = slots.max() + 1 if len(slots) else 0
+        if size > len(self.live):
+            for name in ("lo", "hi", "live"):
+                column = getattr(self, name)
+                new = zeros((size,) + column.shape[1:], dtype=column.dtype)
+                new[:len(column)] = column
+                setattr(self, name, new)
+        self.live[:] = False
+        self.live[slots] = True
+        self.lo[slots] = lo
+        self.hi[slots] = hi
+        self.slots = slots
+
+    def remove(self, slot):
+        if slot < len(self.live):
+            self.live[slot] = False
+
+    def pairs(self):
+        """
+        Return (first, second) arrays of slots whose boxes overlap. Each pair
+        is given once, with first > second, sorted by first then second.
+        """
+        raise NotImplementedError()
+
+    def query(self, lo, hi):
+        """
+        Slots whose box overlaps the box (lo, hi).
+        """
+        raise NotImplementedError()
+
+    def _touching(self, first, second):
+        return (
+            (self.lo[first] <= self.hi[second]) & (self.lo[second] <= self.hi[first])
+        ).all(-1) & self.live[first] & self.live[second]
+
+    def _finish(self, first, second):
+        """
+        Order, de-duplicate and exact-test a list of candidate pairs.
+        """
+        first = array(first, dtype=int)
+        second = array(second, dtype=int)
+        a = maximum(first, second)
+        b = minimum(first, second)
+        keep = a != b
+        a = a[keep]
+        b = b[keep]
+        if len(a):
+            key = unique(a * len(self.live) + b)
+            a = key // len(self.live)
+            b = key % len(self.live)
+        touching = self._touching(a, b)
+        return a[touching], b[touching]
+
+    def _brute_query(self, lo, hi):
+        slots = flatnonzero(self.live)
+        touching = ((self.lo[slots] <= hi) & (lo <= self.hi[slots])).all(-1)
+        return slots[touching]
+
+
+class RTreeBroadPhase(BroadPhase):
+    """
+    libspatialindex R-tree.
+
+    In "rebuild" mode the index is bulk loaded from scratch every update. In
+    "incremental" mode each slot is indexed by a box padded by *lookahead*
+    ticks of travel, and only slots that have left their padded ("fat") box
+    are deleted and re-inserted. If more than *rebuild_fraction* of the slots
+    escaped in one update, the index is bulk loaded instead.
+    """
+
+    def __init__(self, mode = "incremental", lookahead = 2, rebuild_fraction = 0.5):
+        super(RTreeBroadPhase, self).__init__()
+        self.mode = mode
+        self.lookahead = lookahead
+        self.rebuild_fraction = rebuild_fraction
+        self._ip = index.Property()
+        self._ip.dimension = 3
+        self._ip.leaf_capacity = 100
+        # Fat box for each indexed slot
+        self._fat_lo = zeros((0, 3))
+        self._fat_hi = zeros((0, 3))
+        self._indexed = zeros(0, dtype=bool)
+        self._new_index()
+
+    def _new_index(self):
+        self.index = index.Index(interleaved=False, properties=self._ip)
+
+    def update(self, slots, lo, hi, travel):
+        super(RTreeBroadPhase, self).update(slots, lo, hi, travel)
+        size = len(self.live)
+        if size > len(self._indexed):
+            for name in ("_fat_lo", "_fat_hi", "_indexed"):
+                column = getattr(self, name)
+                new = zeros((size,) + column.shape[1:], dtype=column.dtype)
+                new[:len(column)] = column
+                setattr(self, name, new)
+
+        if self.mode == "rebuild":
+            self._fat_lo[slots] = lo
+            self._fat_hi[slots] = hi
+            self.rebuild_index()
+            return
+
+        escaped = ~self._indexed[slots] | \
+            (lo < self._fat_lo[slots]).any(1) | \
+            (hi > self._fat_hi[slots]).any(1)
+        moved = slots[escaped]
+        if not len(moved):
+            return
+
+        pad = (travel[escaped] * self.lookahead)[:, newaxis]
+        new_lo = lo[escaped] - pad
+        new_hi = hi[escaped] + pad
+
+        if len(moved) > self.rebuild_fraction * len(slots):
+            self._fat_lo[moved] = new_lo
+            self._fat_hi[moved] = new_hi
+            self.rebuild_index()
+            return
+
+        for slot, l, h in zip(moved.tolist(), new_lo, new_hi):
+            if self._indexed[slot]:
+                self.index.delete(slot, self._fat_box(slot))
+            self.index.insert(slot, (l[0], h[0], l[1], h[1], l[2], h[2]))
+        self._fat_lo[moved] = new_lo
+        self._fat_hi[moved] = new_hi
+        self._indexed[moved] = True
+
+    def rebuild_index(self):
+        """
+        Throw away the index and bulk load a new one from the current fat
+        boxes, using the rtree stream constructor.
+        """
+        slots = flatnonzero(self.live).tolist()
+        self._indexed[:] = False
+        if not slots:
+            self._new_index()
+            return
+        stream = ((slot, self._fat_box(slot), None) for slot in slots)
+        self.index = index.Index(stream, interleaved=False, properties=self._ip)
+        self._indexed[slots] = True
+
+    def remove(self, slot):
+        if slot < len(self._indexed) and self._indexed[slot]:
+            self.index.delete(slot, self._fat_box(slot))
+            self._indexed[slot] = False
+        super(RTreeBroadPhase, self).remove(slot)
+
+    def _fat_box(self, slot):
+        l = self._fat_lo[slot]
+        h = self._fat_hi[slot]
+        return (l[0], h[0], l[1], h[1], l[2], h[2])
+
+    def pairs(self):
+        first, second = [], []
+        for slot in self.slots.tolist():
+            l = self.lo[slot]
+            h = self.hi[slot]
+            for other in self.index.intersection((l[0], h[0], l[1], h[1], l[2], h[2])):
+                # Each pair is found from both ends, keep one
+                if other < slot:
+                    first.append(slot)
+                    second.append(other)
+        return self._finish(first, second)
+
+    def query(self, lo, hi):
+        found = array(list(self.index.intersection((lo[0], hi[0], lo[1], hi[1], lo[2], hi[2]))), dtype=int)
+        touching = ((self.lo[found] <= hi) & (lo <= self.hi[found])).all(-1) & self.live[found]
+        return found[touching]
+
+
+class SpatialHashBroadPhase(BroadPhase):
+    """
+    Uniform grid, hashed. Every box is entered into each grid cell it
+    touches, the (cell key, slot) table is sorted by key, and pairs are read
+    off the runs of equal keys. All of that is done with array operations,
+    so there is no per-object work in Python at all.
+
+    *cell_size* defaults to twice the median box size, worked out on every
+    update. Boxes that would cover more than MAX_CELLS cells are kept out of
+    the grid and checked against everything directly.
+
+    Suits populations that are spread thinly, like the GEO ring, much better
+    than it suits tight clusters (a cluster all in one cell is O(n**2)).
+    """
+
+    MAX_CELLS = 64
+
+    # Large primes for hashing cell coordinates
+    P1 = 73856093
+    P2 = 19349663
+    P3 = 83492791
+
+    def __init__(self, cell_size = None):
+        super(SpatialHashBroadPhase, self).__init__()
+        self.cell_size = cell_size
+        self._keys = zeros(0, dtype="i8")
+        self._ids = zeros(0, dtype=int)
+        self._oversize = zeros(0, dtype=int)
+
+    def update(self, slots, lo, hi, travel):
+        super(SpatialHashBroadPhase, self).update(slots, lo, hi, travel)
+        if not len(slots):
+            self._keys = zeros(0, dtype="i8")
+            self._ids = zeros(0, dtype=int)
+            self._oversize = zeros(0, dtype=int)
+            return
+
+        cell_size = self.cell_size
+        if cell_size is None:
+            cell_size = 2 * median((hi - lo).max(1))
+        cell_size = max(cell_size, 1.0)
+
+        c_lo = floor(lo / cell_size).astype("i8")
+        c_hi = floor(hi / cell_size).astype("i8")
+        spans = c_hi - c_lo + 1
+        count = spans.prod(1)
+
+        oversize = count > self.MAX_CELLS
+        self._oversize = slots[oversize]
+        keep = ~oversize
+        c_lo = c_lo[keep]
+        spans = spans[keep]
+        count = count[keep]
+        ids = slots[keep]
+
+        # Expand each box into one row per cell it covers
+        rows = repeat(arange(len(ids)), count)
+        k = arange(count.sum()) - repeat(cumsum(count) - count, count)
+        sx = spans[rows, 0]
+        sy = spans[rows, 1]
+        cx = c_lo[rows, 0] + k % sx
+        cy = c_lo[rows, 1] + (k // sx) % sy
+        cz = c_lo[rows, 2] + k // (sx * sy)
+
+        keys = (cx * self.P1) ^ (cy * self.P2) ^ (cz * self.P3)
+        order = argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._ids = ids[rows[order]]
+
+    def pairs(self):
+        keys = self._keys
+        ids = self._ids
+        n = len(keys)
+        firsts = []
+        seconds = []
+
+        if n:
+            # Runs of equal keys, and each row's place in its run
+            starts = flatnonzero(concatenate(([True], keys[1:] != keys[:-1])))
+            sizes = diff(concatenate((starts, [n])))
+            run = repeat(arange(len(starts)), sizes)
+            place = arange(n) - starts[run]
+            # Pair each row with every row after it in the same run
+            after = sizes[run] - place - 1
+            left = repeat(arange(n), after)
+            k = arange(after.sum()) - repeat(cumsum(after) - after, after)
+            right = left + 1 + k
+            firsts.append(ids[left])
+            seconds.append(ids[right])
+
+        # Oversize boxes against everything
+        for slot in self._oversize.tolist():
+            others = self._brute_query(self.lo[slot], self.hi[slot])
+            firsts.append(full(len(others), slot, dtype=int))
+            seconds.append(others)
+
+        if not firsts:
+            return self._finish([], [])
+        return self._finish(concatenate(firsts), concatenate(seconds))
+
+    def query(self, lo, hi):
+        # Rare enough (not part of the tick) that a straight scan is fine.
+        return self._brute_query(lo, hi)
+
+
+class SweepAndPruneBroadPhase(BroadPhase):
+    """
+    Sort and sweep. Boxes are sorted by their low edge along the axis where
+    the scene is most spread out; each box's candidates are then the boxes
+    that start before it ends, which is a single searchsorted for the whole
+    scene. Candidates are checked on the other two axes afterwards.
+    """
+
+    def pairs(self):
+        slots = flatnonzero(self.live)
+        n = len(slots)
+        if not n:
+            return self._finish([], [])
+        lo = self.lo[slots]
+        hi = self.hi[slots]
+
+        axis = ((lo + hi)/2).var(0).argmax()
+        order = argsort(lo[:, axis], kind="stable")
+        start = lo[order, axis]
+        end = searchsorted(start, hi[order, axis], side="right")
+
+        # Boxes after each box (in sorted order) that start before it ends
+        count = maximum(end - arange(n) - 1, 0)
+        left = repeat(arange(n), count)
+        right = left + 1 + arange(count.sum()) - repeat(cumsum(count) - count, count)
+        return self._finish(slots[order[left]], slots[order[right]])
+
+    def query(self, lo, hi):
+        return self._brute_query(lo, hi)
+
+
+if __name__ == "__main__":
+    #
+    # Benchmark the backends on the GEO catalogue.
+    #
+    import sys
+    import time
+
+    from deltav.physics.body import Body
+    from deltav.physics.orbit import Orbit
+    from deltav.physics.util import load_tle_file
+    from deltav.maps._store import SceneStore
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/celestrak/geo.txt"
+    ticks = 100
+
+    earth = Body(5.972e24, 6371000)
+    store = SceneStore()
+    for tle in load_tle_file(path):
+        body = Body(15000, 10)
+        body.orbit(earth, *Orbit.vecs_from_tle(tle, earth, body))
+        store.add(body)
+    slots = store.slots()
+    print("%s objects from %s" % (len(slots), path))
+
+    for name, broadphase in (
+        ("rtree (rebuild)", RTreeBroadPhase("rebuild")),
+        ("rtree (incremental)", RTreeBroadPhase("incremental")),
+        ("spatial hash", SpatialHashBroadPhase()),
+        ("sort and sweep", SweepAndPruneBroadPhase()),
+    ):
+        found = 0
+        elapsed = 0
+        position = store.position[slots].astype(float)
+        for _ in range(ticks):
+            store.step(1)
+            start = position
+            _, position, velocity = store.propagate()
+            position = position.astype(float)
+            travel = norm(velocity.astype(float), axis=1)
+            r = (store.radius[slots].astype(float)/2)[:, newaxis]
+            lo = minimum(start, position) - r
+            hi = maximum(start, position) + r
+            t = time.time()
+            broadphase.update(slots, lo, hi, travel)
+            first, _ = broadphase.pairs()
+            elapsed += time.time() - t
+            found += len(first)
+        print("%-20s %8.3f ms/tick  %d pairs" % (name, 1000 * elapsed / ticks, found))
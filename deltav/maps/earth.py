@@ -1,10 +1,22 @@
 
 from deltav.physics.body import Body
 from deltav.ships import MobShip
-from deltav.physics.util import load_tle_file
-from deltav.physics.orbit import Orbit
+from deltav.physics.catalogue import load_catalogue, state_vectors
 
 from deltav.maps._base import BaseScene
+from deltav.maps.broadphase import SpatialHashBroadPhase
+
+
+def add_catalogue(scene, catalogue, parent):
+    """
+    Add a MobShip orbiting *parent* to *scene* for every satellite in
+    *catalogue*.
+    """
+    positions, velocities = state_vectors(catalogue, parent)
+    for name, position, velocity in zip(catalogue.name, positions, velocities):
+        ship = MobShip(str(name))
+        ship.orbit(parent, position, velocity)
+        scene.add(ship)
 
 
 class EarthMoonSystem(BaseScene):
@@ -26,8 +38,21 @@ class EarthMoonSystem(BaseScene):
         ))
         self.add(shuttle)
 
-        for tle in load_tle_file("data/celestrak/stations.txt", max=30): # 17 or greater causes collisions?
-            ship = MobShip(tle["name"])
-            vecs = Orbit.vecs_from_tle(tle, earth, ship)
-            ship.orbit(earth, *vecs)
-            self.add(ship)
\ No newline at end of file
+        catalogue = load_catalogue("data/celestrak/stations.txt", max=30, cache=True) # 17 or greater causes collisions?
+        add_catalogue(self, catalogue, earth)
+
+
+class GeostationaryBelt(BaseScene):
+    """
+    Everything in the GEO catalogue. The objects sit in a thin ring, which a
+    hashed grid handles much better than an RTree.
+    """
+
+    BROAD_PHASE = SpatialHashBroadPhase
+
+    def setup(self):
+        earth = Body(5.972e24, 6371000)
+
+        self.add_body(earth)
+
+        add_catalogue(self, load_catalogue("data/celestrak/geo.txt", cache=True), earth)
@@ -0,0 +1,124 @@
+"""
+Closest approach between pairs of orbital arcs.
+
+Each arc is given by its state (position, velocity) at the start and at the
+end of an interval. Over an interval that is short compared with the orbital
+period, a cubic Hermite curve through those two states follows the Keplerian
+arc very closely, and the difference of two Hermite curves is itself a cubic.
+So the time of closest approach is the minimum of a polynomial in one
+variable, which we can find for many pairs at once.
+"""
+
+from numpy import linspace, sqrt, clip, argmin, newaxis, errstate, where
+
+from deltav.physics.helpers import _float
+
+
+def _relative_cubic(p1a, v1a, p1b, v1b, p2a, v2a, p2b, v2b, dt):
+    """
+    Coefficients (c0, c1, c2, c3) of the relative position of arc 1 from arc
+    2, as a cubic in s = t/dt.
+    """
+    r0 = p1a - p2a
+    r1 = p1b - p2b
+    w0 = (v1a - v2a) * dt
+    w1 = (v1b - v2b) * dt
+    c0 = r0
+    c1 = w0
+    c2 = -3*r0 - 2*w0 + 3*r1 - w1
+    c3 = 2*r0 + w0 - 2*r1 + w1
+    return c0, c1, c2, c3
+
+
+def hermite(p0, v0, p1, v1, dt, s):
+    """
+    Position on the cubic Hermite curve through (p0, v0) and (p1, v1) at
+    fraction *s* of an interval *dt* seconds long.
+    """
+    s2 = s*s
+    s3 = s2*s
+    return (2*s3 - 3*s2 + 1) * p0 + (s3 - 2*s2 + s) * dt * v0 + \
+        (-2*s3 + 3*s2) * p1 + (s3 - s2) * dt * v1
+
+
+def closest_approach(p1a, v1a, p1b, v1b, p2a, v2a, p2b, v2b, dt,
+                     samples = 8, iterations = 4, within = None):
+    """
+    Find the time of closest approach between arc 1 and arc 2 over an
+    interval of *dt* seconds. All state arguments are (N, 3) arrays (the "a"
+    states are at the start of the interval, "b" at the end), and *dt* is a
+    scalar or (N,) array.
+
+    Returns (t, distance), both (N,) arrays, with t measured from the start
+    of the interval.
+
+    The minimum is bracketed by sampling the relative distance, then polished
+    with a few Newton steps on d(|r|^2)/dt = 0.
+
+    If only pairs that come *within* some distance matter, pass it: pairs
+    the cubic can't bring that close (|c0| - |c1| - |c2| - |c3| > within)
+    aren't searched, and get t = 0 and that lower bound as their distance.
+    """
+    n = len(p1a)
+    if n == 0:
+        return p1a[:, 0].copy(), p1a[:, 0].copy()
+
+    dt_ = _float(1) * dt
+    dt_col = dt_[:, newaxis] if getattr(dt_, "ndim", 0) else dt_
+    c0, c1, c2, c3 = _relative_cubic(p1a, v1a, p1b, v1b, p2a, v2a, p2b, v2b, dt_col)
+
+    if within is None:
+        s, distance = _search((c0, c1, c2, c3), samples, iterations)
+        return s * dt_, distance
+
+    bound = _norm(c0) - _norm(c1) - _norm(c2) - _norm(c3)
+    near = (bound <= within).nonzero()[0]
+    s = bound * 0
+    distance = bound.copy()
+    s[near], distance[near] = _search(
+        (c0[near], c1[near], c2[near], c3[near]), samples, iterations)
+    return s * dt_, distance
+
+
+def _norm(v):
+    return sqrt((v**2).sum(-1))
+
+
+def _search(coefficients, samples, iterations):
+    """
+    Fraction of the interval at which each relative cubic is closest to
+    zero, and the distance there.
+    """
+    c0, c1, c2, c3 = coefficients
+    n = len(c0)
+
+    # Bracket
+    s = linspace(0, 1, samples + 1).astype(_float)
+    sv = s[newaxis, :, newaxis]
+    d = c0[:, newaxis] + sv*(c1[:, newaxis] + sv*(c2[:, newaxis] + sv*c3[:, newaxis]))
+    dist2 = (d**2).sum(-1)
+    best = argmin(dist2, axis=1)
+    s = s_bracket = s[best]
+    dist2_bracket = dist2[range(n), best]
+
+    # Polish
+    for _ in range(iterations):
+        sc = s[:, newaxis]
+        d = c0 + sc*(c1 + sc*(c2 + sc*c3))
+        d1 = c1 + sc*(2*c2 + sc*3*c3)
+        d2 = 2*c2 + 6*c3*sc
+        g = (d*d1).sum(-1)
+        g1 = (d1*d1).sum(-1) + (d*d2).sum(-1)
+        with errstate(divide="ignore", invalid="ignore"):
+            step = where(g1 > 0, g/g1, 0)
+        s = clip(s - step, 0, 1)
+
+    sc = s[:, newaxis]
+    d = c0 + sc*(c1 + sc*(c2 + sc*c3))
+    dist2 = (d**2).sum(-1)
+    # Newton can wander off on a very flat curve, never do worse than the
+    # bracketing sample.
+    worse = dist2 > dist2_bracket
+    s[worse] = s_bracket[worse]
+    dist2[worse] = dist2_bracket[worse]
+    return s, sqrt(dist2)
@@ -0,0 +1,404 @@
+"""
+Batch two-body propagation.
+
+Holds the epoch state of many orbits as a structure of arrays, and solves the
+universal Kepler equation for all of them at once. This is the same universal
+variable formulation used by Orbit.get_position, just run over whole columns
+instead of one object at a time.
+
+Elliptical rows take the same closed-form shortcut as Orbit.get_position:
+advance the mean anomaly and solve Kepler's equation in the perifocal frame.
+"""
+
+from numpy import (
+    pi,
+    sqrt,
+    sign,
+    cos, cosh,
+    sin, sinh,
+    tan, arctan,
+    log,
+    zeros, ones, full, empty, where, maximum, arange,
+    isfinite,
+    errstate,
+)
+
+from deltav.physics.helpers import _float, array
+from deltav.physics.orbit import Orbit
+
+
+ACCURACY = Orbit.ACCURACY
+
+# Hard cap on Newton-Raphson passes, so one bad lane can't stall the batch.
+MAX_ITERATIONS = Orbit.MAX_ITERATIONS
+
+
+def stumpff(psi):
+    """
+    Vectorized version of Orbit._stumpff. Returns (c2, c3) arrays with the
+    same shape as *psi*.
+    """
+    c2 = full(psi.shape, _float("0.5"), dtype=_float)
+    c3 = full(psi.shape, _float("1.0")/_float("6.0"), dtype=_float)
+
+    pos = psi > ACCURACY
+    if pos.any():
+        p = psi[pos]
+        sq_psi = sqrt(p)
+        c2[pos] = (1 - cos(sq_psi)) / p
+        c3[pos] = (sq_psi - sin(sq_psi)) / sq_psi**3
+
+    neg = (psi < 0) & (abs(psi) > ACCURACY)
+    if neg.any():
+        p = psi[neg]
+        sq_psi = sqrt(-p)
+        c2[neg] = (1 - cosh(sq_psi)) / p
+        c3[neg] = (sinh(sq_psi) - sq_psi) / sqrt(-p**3)
+
+    return c2, c3
+
+
+class BatchPropagator(object):
+    """
+    Epoch state for a set of orbits, stored column-wise:
+
+        r0, v0          -- (N, 3) position and velocity at the zero epoch
+        alpha           -- (N,) 1/a (the Orbit._alpha value)
+        mu              -- (N,) gravitational parameter of the parent
+        t_delta         -- (N,) seconds since the zero epoch
+
+    Elliptical rows also keep their elements for the closed form solution:
+
+        p, q            -- (N, 3) perifocal basis (Orbit.perifocal_basis)
+        ecc, sma        -- (N,) eccentricity and semi-major axis
+        m0, n           -- (N,) mean anomaly at the zero epoch, mean motion
+
+    Rows are addressed by index. Rows can be re-loaded from an Orbit whenever
+    it resets its epoch (i.e. after an acceleration).
+    """
+
+    # (column name, fill value for unused rows)
+    _COLUMNS = (
+        ("r0", 0), ("v0", 0), ("alpha", 0), ("mu", 1), ("t_delta", 0),
+        ("mag_r0", 1), ("dot_rv", 0), ("sqrt_mu", 1), ("period", _float("nan")),
+        ("p", 0), ("q", 0), ("ecc", 0), ("sma", 1), ("m0", 0), ("n", 0),
+    )
+
+    _VECTORS = ("r0", "v0", "p", "q")
+
+    def __init__(self, size = 0):
+        # mag_r0, dot_rv, sqrt_mu and period are derived from the others, and
+        # are filled in by _derive()
+        for name, fill in self._COLUMNS:
+            shape = (size, 3) if name in self._VECTORS else (size,)
+            setattr(self, name, self._column(name, shape, fill))
+
+    def __len__(self):
+        return len(self.t_delta)
+
+    def _column(self, name, shape, fill):
+        """
+        A new array for column *name*. Subclasses can keep their columns
+        somewhere other than the heap (see deltav.physics.parallel).
+        """
+        return full(shape, fill, dtype=_float)
+
+    @classmethod
+    def from_orbits(cls, orbits):
+        orbits = list(orbits)
+        batch = cls(len(orbits))
+        for i, orbit in enumerate(orbits):
+            batch.set_orbit(i, orbit)
+        return batch
+
+    def set_orbit(self, i, orbit):
+        """
+        Copy the epoch state of *orbit* into row *i*.
+        """
+        self.r0[i] = orbit.v_position
+        self.v0[i] = orbit.v_velocity
+        self.alpha[i] = orbit._alpha
+        self.mu[i] = orbit.gravitational_parameter
+        self.t_delta[i] = orbit.t_delta
+        self._derive(i)
+        el = orbit.elements
+        if el.is_elliptical:
+            self.p[i], self.q[i] = el.perifocal_basis
+            self.ecc[i] = el.eccentricity
+            self.sma[i] = el.semi_major_axis
+            self.m0[i] = el.mean_anomaly_at_epoch
+            self.n[i] = el.mean_motion
+
+    def _derive(self, i):
+        self.mag_r0[i] = sqrt((self.r0[i]**2).sum(-1))
+        self.dot_rv[i] = (self.r0[i] * self.v0[i]).sum(-1)
+        self.sqrt_mu[i] = sqrt(self.mu[i])
+        alpha = self.alpha[i]
+        elliptical = alpha > ACCURACY
+        with errstate(divide="ignore", invalid="ignore"):
+            self.period[i] = where(
+                elliptical,
+                2 * pi * sqrt(abs(1/alpha)**3 / self.mu[i]),
+                _float("nan"),
+            )
+
+    def step(self, delta_seconds):
+        """
+        Advance every orbit's epoch. Same as calling Orbit.step on each.
+        """
+        self.t_delta += _float(delta_seconds)
+
+    def resize(self, size):
+        """
+        Grow (or shrink) every column to *size* rows, keeping existing rows.
+        New rows are filled with harmless defaults.
+        """
+        old = len(self)
+        keep = min(old, size)
+        for name, fill in self._COLUMNS:
+            column = getattr(self, name)
+            new = self._column(name, (size,) + column.shape[1:], fill)
+            new[:keep] = column[:keep]
+            setattr(self, name, new)
+
+    def take(self, rows):
+        """
+        A new propagator with copies of just *rows*, in that order.
+        """
+        batch = BatchPropagator()
+        for name, _ in self._COLUMNS:
+            setattr(batch, name, getattr(self, name)[rows])
+        return batch
+
+    def propagate(self, delta_seconds = None, rows = None):
+        """
+        Return (positions, velocities, valid): two (N, 3) arrays and an (N,)
+        mask of the lanes that came out finite. Invalid lanes
+        hold garbage (usually nan), but never stop the rest of the batch.
+
+        If delta_seconds is given (scalar or (N,) array) it is used instead of
+        the stored t_delta. *rows* selects a subset of rows (any numpy index),
+        in which case N is the size of that subset.
+        """
+        if rows is None:
+            rows = slice(None)
+        t_delta = self.t_delta[rows]
+        if delta_seconds is None:
+            dt = t_delta.copy()
+        else:
+            dt = empty(len(t_delta), dtype=_float)
+            dt[:] = delta_seconds
+
+        rows = arange(len(self))[rows]
+        positions = empty((len(rows), 3), dtype=_float)
+        velocities = empty((len(rows), 3), dtype=_float)
+        valid = empty(len(rows), dtype=bool)
+
+        elliptical = self.alpha[rows] > ACCURACY
+        e_rows = rows[elliptical]
+        positions[elliptical], velocities[elliptical], valid[elliptical] = elliptical_position(
+            self.p[e_rows], self.q[e_rows], self.ecc[e_rows], self.sma[e_rows],
+            self.m0[e_rows], self.n[e_rows], self.mu[e_rows],
+            dt[elliptical] % self.period[e_rows],
+        )
+
+        rest = ~elliptical
+        u_rows = rows[rest]
+        positions[rest], velocities[rest], valid[rest] = universal(
+            self.r0[u_rows], self.v0[u_rows], self.alpha[u_rows], self.mu[u_rows],
+            self.mag_r0[u_rows], self.dot_rv[u_rows], self.sqrt_mu[u_rows],
+            self.period[u_rows], dt[rest],
+        )
+        return positions, velocities, valid
+
+    def _shape(self, rows):
+        """
+        Squared angular momentum, eccentricity and μ of each orbit.
+        """
+        if rows is None:
+            rows = slice(None)
+        mu = self.mu[rows]
+        h2 = (_angular_momentum(self.r0[rows], self.v0[rows])**2).sum(-1)
+        e = sqrt(maximum(1 - h2 * self.alpha[rows] / mu, 0))
+        return h2, e, mu
+
+    def periapsis_rate(self, rows = None):
+        """
+        Angular rate (radians per second) of each orbit at periapsis, which
+        is the fastest it ever turns around its parent: μ²(1 + e)²/h³.
+        Radial orbits (h = 0) come out as inf.
+        """
+        h2, e, mu = self._shape(rows)
+        with errstate(divide="ignore"):
+            return mu**2 * (1 + e)**2 / h2**_float("1.5")
+
+    def apsides(self, rows = None):
+        """
+        (periapsis, apoapsis) radius of each orbit. Apoapsis is inf for
+        anything that isn't elliptical.
+        """
+        h2, e, mu = self._shape(rows)
+        p = h2 / mu
+        with errstate(divide="ignore"):
+            return p / (1 + e), where(e < 1, p / (1 - e), _float("inf"))
+
+
+def kepler(m_anom, eccentricity):
+    """
+    Vectorized version of helpers.kepler (same starter, Halley iterations).
+    """
+    sin_m = sin(m_anom)
+    cos_m = cos(m_anom)
+    e = eccentricity
+    e_anom = where(
+        e < _float("0.3"),
+        m_anom + e*sin_m + e**2 * sin_m*cos_m + e**3 * sin_m * (cos_m**2 - sin_m**2 / 2),
+        m_anom + _float("0.85") * e * sign(sin_m),
+    )
+
+    active = ones(len(e_anom), dtype=bool)
+    iterations = 0
+    while active.any() and iterations < MAX_ITERATIONS:
+        iterations += 1
+        idx = active.nonzero()[0]
+        _e = e[idx]
+        _anom = e_anom[idx]
+        e_sin = _e * sin(_anom)
+        e_cos = _e * cos(_anom)
+        diff = _anom - e_sin - m_anom[idx]
+        d1 = 1 - e_cos
+        e_anom[idx] = _anom - diff / (d1 - diff * e_sin / (2 * d1))
+        active[idx] = abs(diff) > ACCURACY
+    return e_anom
+
+
+def _finite(positions, velocities):
+    return isfinite(positions).all(-1) & isfinite(velocities).all(-1)
+
+
+@errstate(divide="ignore", over="ignore", invalid="ignore")
+def elliptical_position(p, q, ecc, sma, m0, n, mu, dt):
+    """
+    Closed form solution for elliptical lanes, as in
+    Orbit._elliptical_position. Returns (positions, velocities, valid).
+    """
+    e_anom = kepler(m0 + n * dt, ecc)
+    cos_e = cos(e_anom)[:, None]
+    sin_e = sin(e_anom)[:, None]
+    e = ecc[:, None]
+    a = sma[:, None]
+    b = sqrt(1 - e**2)
+
+    positions = a * (cos_e - e) * p + a * b * sin_e * q
+    speed = sqrt(mu[:, None] * a) / (a * (1 - e * cos_e))
+    velocities = speed * (b * cos_e * q - sin_e * p)
+    return positions, velocities, _finite(positions, velocities)
+
+
+@errstate(divide="ignore", over="ignore", invalid="ignore")
+def universal(r0, v0, alpha, mu, mag_r0, dot_rv, sqrt_mu, period, dt):
+    """
+    Solve the universal Kepler equation for every lane. *dt* is modified in
+    place. Returns (positions, velocities, valid): two (N, 3) arrays and a
+    mask of the lanes that came out finite.
+    """
+    n = len(dt)
+    positions = empty((n, 3), dtype=_float)
+    velocities = empty((n, 3), dtype=_float)
+    if n == 0:
+        return positions, velocities, zeros(0, dtype=bool)
+
+    elliptical = alpha > ACCURACY
+    parabolic = abs(alpha) < ACCURACY
+    hyperbolic = ~(elliptical | parabolic)
+
+    # Only matters for elliptical orbits.
+    dt[elliptical] %= period[elliptical]
+
+    #
+    # Initial guesses for chi, as in Orbit.get_position.
+    #
+    chi = zeros(n, dtype=_float)
+
+    m = elliptical
+    if m.any():
+        chi[m] = sqrt_mu[m] * dt[m] * alpha[m]
+        fuzz = m & (abs(alpha) - 1 < ACCURACY)
+        chi[fuzz] *= _float("0.97")
+
+    m = parabolic
+    if m.any():
+        h2 = (_angular_momentum(r0[m], v0[m])**2).sum(-1)
+        p = h2 / mu[m]
+        _s = ((pi/2) - arctan(dt[m] * 3 * sqrt(mu[m] / p**3))) / 2
+        _w = arctan(tan(_s)**(_float("1")/_float("3")))
+        chi[m] = sqrt(p) * (2 / tan(2 * _w))
+
+    m = hyperbolic
+    if m.any():
+        a = 1/alpha[m]
+        _dt = dt[m]
+        # Taking dt = 0 as forwards, so the denominator can't vanish at
+        # periapsis (where dot_rv is 0 too).
+        _num = (-2 * mu[m] * _dt * alpha[m]) / (
+            dot_rv[m] + where(_dt < 0, -1, 1) * sqrt(-mu[m] * a) *
+            (1 - mag_r0[m] * alpha[m])
+        )
+        _num = maximum(_num, ACCURACY)
+        chi[m] = sign(_dt) * sqrt(-a) * log(_num)
+
+    #
+    # Masked Newton-Raphson. Lanes drop out of the active set as soon as
+    # they converge, so later passes only do work for the slow lanes.
+    #
+    active = ones(n, dtype=bool)
+    iterations = 0
+    while active.any() and iterations < MAX_ITERATIONS:
+        iterations += 1
+        idx = active.nonzero()[0]
+        _chi = chi[idx]
+        _alpha = alpha[idx]
+        _smu = sqrt_mu[idx]
+        _rv = dot_rv[idx] / _smu
+        _r0 = mag_r0[idx]
+
+        psi = _chi**2 * _alpha
+        c2, c3 = stumpff(psi)
+
+        _r = _chi**2 * c2 + _rv * _chi * (1 - psi*c3) + _r0 * (1 - psi*c2)
+        chi_ = _chi + (
+            _smu * dt[idx] -
+            _chi**3 * c3 -
+            _rv * _chi**2 * c2 -
+            _r0 * _chi * (1 - psi*c3)
+        ) / _r
+
+        chi[idx] = chi_
+        active[idx] = abs(chi_ - _chi) > ACCURACY
+
+    #
+    # f and g functions, for all lanes at once
+    #
+    psi = chi**2 * alpha
+    c2, c3 = stumpff(psi)
+
+    f = 1 - (chi**2 * c2 / mag_r0)
+    g = dt - chi**3 * c3 / sqrt_mu
+
+    positions[:] = f[:, None] * r0 + g[:, None] * v0
+
+    mag_position = sqrt((positions**2).sum(-1))
+    g_dot = 1 - (chi**2 * c2 / mag_position)
+    f_dot = (sqrt_mu * chi / (mag_r0 * mag_position)) * (psi * c3 - 1)
+
+    velocities[:] = f_dot[:, None] * r0 + g_dot[:, None] * v0
+
+    return positions, velocities, _finite(positions, velocities)
+
+
+def _angular_momentum(r, v):
+    return array([
+        r[:, 1]*v[:, 2] - r[:, 2]*v[:, 1],
+        r[:, 2]*v[:, 0] - r[:, 0]*v[:, 2],
+        r[:, 0]*v[:, 1] - r[:, 1]*v[:, 0],
+    ]).T
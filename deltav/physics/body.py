@@ -13,10 +13,20 @@ from deltav.physics.orbit import Orbit
 from deltav.physics.helpers import cbrt, cached_property
 
 
+# Object kinds, as kept in the scene store's "kind" column
+KIND_BODY = 0
+KIND_SHIP = 1
+KIND_MISSILE = 2
+KIND_DEBRIS = 3
+
+# Bits for the scene store's "flags" column
+FLAG_DESTRUCTABLE = 1
+FLAG_DESTROYED = 2
+
+
 class Body(object):
 
-    destructable = False
-    destroyed = False
+    kind = KIND_BODY
     
     def __init__(self, mass = 0, radius = 0):
         self._name = ""
@@ -24,6 +34,11 @@ class Body(object):
         self._radius = radius
         self._orbit = None
 
+        # Set while the body is held in a scene store (see deltav.maps._store)
+        self._store = None
+        self._slot = None
+        self._flags = 0
+
         self.uuid = uuid.uuid4().hex
 
         self.propery_cache = {}
@@ -37,7 +52,9 @@ class Body(object):
 
 
     def get_position(self):
-        if self._orbit:
+        if self._store is not None:
+            return self._store.position[self._slot].copy()
+        elif self._orbit:
             p, v = self._orbit.get_position()
             return p
         else:
@@ -45,12 +62,56 @@ class Body(object):
 
 
     def get_velocity(self):
-        if self._orbit:
+        if self._store is not None:
+            return self._store.velocity[self._slot].copy()
+        elif self._orbit:
             p, v = self._orbit.get_position()
             return v
         else:
             return (0, 0, 0)
 
+    #
+    # Scene store facade
+    #
+
+    def _attach(self, store, slot):
+        self._store = store
+        self._slot = slot
+
+    def _detach(self):
+        self._store = None
+        self._slot = None
+
+    def _orbit_changed(self):
+        """
+        Called by our orbit whenever its zero epoch is reset.
+        """
+        if self._store is not None:
+            self._store.sync(self)
+
+    def _get_flag(self, flag):
+        if self._store is not None:
+            return bool(self._store.flags[self._slot] & flag)
+        return bool(self._flags & flag)
+
+    def _set_flag(self, flag, value):
+        if value:
+            self._flags |= flag
+        else:
+            self._flags &= ~flag
+        if self._store is not None:
+            self._store.flags[self._slot] = self._flags
+
+    destructable = property(
+        lambda self: self._get_flag(FLAG_DESTRUCTABLE),
+        lambda self, value: self._set_flag(FLAG_DESTRUCTABLE, value),
+    )
+
+    destroyed = property(
+        lambda self: self._get_flag(FLAG_DESTROYED),
+        lambda self, value: self._set_flag(FLAG_DESTROYED, value),
+    )
+
     #
     # For subclassing
     #
@@ -78,7 +139,7 @@ class Body(object):
             semi_major_axis = self._orbit.semi_major_axis
             eccentricity = self._orbit.eccentricity
 
-            return semi_major_axis * (1 - eccentricity) * cbrt(-3, self.mass / (3 * parent_mass))
+            return semi_major_axis * (1 - eccentricity) * cbrt(self.mass / (3 * parent_mass))
 
 
     @property
@@ -117,7 +178,28 @@ class Body(object):
         Set the orbit of the ship around an object
         """
         self._orbit = Orbit(parent, self, position, velocity)
+        self._orbit_changed()
 
     def game_tick(self, dt):
         if self._orbit:
-            self._orbit.step(dt)
\ No newline at end of file
+            self._orbit.step(dt)
+
+    def next_event(self):
+        """
+        Game seconds until this object next needs a tick to land on a
+        particular time, or None if it can coast for as long as the scene
+        likes. The scene uses this to jump ahead (see BaseScene.next_event).
+
+        For a plain body that is leaving its parent's sphere of influence:
+        the soonest it could get there at its top speed (at periapsis, μ(1+e)/h).
+        """
+        if not self._orbit:
+            return None
+        limit = self._orbit.parent.hill_radius
+        el = self._orbit.elements
+        if el.is_elliptical and el.semi_major_axis * (1 + el.eccentricity) < limit:
+            return None
+        distance = norm(self.get_position())
+        if not distance < limit:
+            return None
+        return (limit - distance) * el.angular_momentum / (el.mu * (1 + el.eccentricity))
\ No newline at end of file
@@ -0,0 +1,471 @@
+"""
+Columnar TLE catalogues.
+
+load_tle_file() hands out one dict per satellite, parsed a slice at a time.
+That is fine for a handful of stations, but a whole catalogue wants to be
+read in one go: load_catalogue() finds the lines of every element set in
+the raw bytes of the file, lines them up as an (N, 69) array of characters,
+and converts each fixed-width field for the whole catalogue at once. The
+result is a TLECatalogue of NumPy columns:
+
+    catalogue = load_catalogue("data/celestrak/geo.txt")
+    catalogue.inclination        # (N,) radians
+    catalogue[0]                 # a parse_tle() style dict, for Orbit.vecs_from_tle
+
+Units are as parse_tle(): meters, radians and seconds, and "mean_motion" is
+seconds per revolution (which is what Orbit.vecs_from_tle expects).
+
+state_vectors() does what Orbit.vecs_from_tle does, for a whole catalogue at
+once:
+
+    positions, velocities = state_vectors(catalogue, earth)
+
+With cache=True, the parsed catalogue is saved next to the text file as a
+structured .npy array, named after a hash of the text, and later loads just
+map that. Editing the text file changes the hash, so the old cache is simply
+never looked for again (and is deleted when the new one is written). Caches
+can be built ahead of time with:
+
+    python -m deltav.physics.catalogue [tle file ...]
+"""
+
+import os
+import glob
+import hashlib
+import tempfile
+
+from numpy import (
+    pi, arange, zeros, ones, where, newaxis, flatnonzero, concatenate,
+    ascontiguousarray, frombuffer, fromfile, memmap, uint8, float64,
+    integer, char,
+    sqrt, sin, cos, stack, datetime64, timedelta64,
+    dtype, empty, load, save,
+)
+
+from deltav.physics.helpers import _float
+from deltav.physics.rotation import perifocal_matrix, rotate
+
+
+LINE_LENGTH = 69
+NAME_LENGTH = 24
+
+CACHE_SUFFIX = ".catalogue.npy"
+
+RAD = pi / _float("180")
+
+# name: (line, first column, last column + 1), 0-based, for plain numbers
+_NUMBERS = {
+    "epoch_year":                   (1, 18, 20),
+    "epoch_day":                    (1, 20, 32),
+    "first_time_derivative":        (1, 33, 43),
+    "element_set_number":           (1, 64, 68),
+    "inclination":                  (2, 8, 16),
+    "long_of_ascending_node":       (2, 17, 25),
+    "argument_of_periapsis":        (2, 34, 42),
+    "mean_anomaly":                 (2, 43, 51),
+    "revolutions_per_day":          (2, 52, 63),
+    "revolution_number_at_epoch":   (2, 63, 68),
+}
+
+# name: (first column, ...) of the "sign, 5 digits, exponent" fields on line 1
+_EXPONENTS = {
+    "second_time_derivative":       44,
+    "bstar_drag_term":              53,
+}
+
+_ANGLES = (
+    "inclination", "long_of_ascending_node",
+    "argument_of_periapsis", "mean_anomaly",
+)
+
+
+class TLECatalogue(object):
+    """
+    Element sets as columns, one row per satellite. COLUMNS are all (N,)
+    arrays; "epoch" is datetime64[us] and "name", "satellite_number",
+    "classification" and "international_designator" are strings.
+    """
+
+    COLUMNS = (
+        "name", "satellite_number", "classification", "international_designator",
+        "epoch", "first_time_derivative", "second_time_derivative",
+        "bstar_drag_term", "element_set_number",
+        "inclination", "long_of_ascending_node", "eccentricity",
+        "argument_of_periapsis", "mean_anomaly", "mean_motion",
+        "revolution_number_at_epoch",
+    )
+
+    def __init__(self, **columns):
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+        # element sets dropped for failing their checksum
+        self.rejected = columns.get("rejected", 0)
+
+    def __len__(self):
+        return len(self.name)
+
+    def __repr__(self):
+        return "<TLECatalogue %d satellites>" % len(self)
+
+    def __getitem__(self, index):
+        """
+        A parse_tle() style dict for an integer index, otherwise (a slice,
+        mask or array of indices) a smaller catalogue.
+        """
+        if isinstance(index, (int, integer)):
+            tle = {name: getattr(self, name)[index] for name in self.COLUMNS}
+            tle["name"] = str(tle["name"])
+            tle["epoch"] = tle["epoch"].astype(object)
+            return tle
+        return TLECatalogue(**{name: getattr(self, name)[index] for name in self.COLUMNS})
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def dtype(cls):
+        """
+        Structured dtype of one row, as stored in a cache file.
+        """
+        fields = {
+            "name": "U%d" % NAME_LENGTH,
+            "satellite_number": "U5",
+            "classification": "U1",
+            "international_designator": "U8",
+            "epoch": "datetime64[us]",
+            "element_set_number": "int64",
+        }
+        return dtype([(name, fields.get(name, _float)) for name in cls.COLUMNS])
+
+    def to_records(self):
+        records = empty(len(self), dtype=self.dtype())
+        for name in self.COLUMNS:
+            records[name] = getattr(self, name)
+        return records
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        A catalogue whose columns are views of *records* (so nothing is
+        copied out of a mapped cache file).
+        """
+        return cls(**{name: records[name] for name in cls.COLUMNS})
+
+
+def state_vectors(catalogue, parent, epoch = None):
+    """
+    Position and velocity of every satellite in *catalogue* (a TLECatalogue,
+    or anything with the same element columns) around *parent*, as (N, 3)
+    arrays. With *epoch* (a datetime), the mean anomalies are moved on from
+    each set's own epoch to that one first. Elliptical orbits only, like
+    Orbit.vecs_from_tle.
+    """
+    # Imported here because the batch module needs Orbit itself
+    from deltav.physics.orbit import Orbit
+    from deltav.physics.batch import kepler
+
+    mu = Orbit.G * parent.mass
+    semi_major_axis = ((catalogue.mean_motion / (2*pi))**2 * mu)**(1/_float("3"))
+    eccentricity = catalogue.eccentricity
+
+    mean_anomaly = catalogue.mean_anomaly
+    if epoch:
+        delta_t = (datetime64(epoch, "us") - catalogue.epoch) / timedelta64(1, "s")
+        mean_anomaly = mean_anomaly + delta_t * sqrt(mu / semi_major_axis**3)
+    mean_anomaly = mean_anomaly % (2*pi)
+
+    eccentric_anomaly = kepler(mean_anomaly, eccentricity)
+    sin_e, cos_e = sin(eccentric_anomaly), cos(eccentric_anomaly)
+    distance = semi_major_axis * (1 - eccentricity * cos_e)
+
+    # In the perifocal frame: x towards periapsis, y along the motion there
+    zero = zeros(len(eccentricity), dtype=_float)
+    speed = sqrt(mu * semi_major_axis) / distance
+    perifocal_positions = stack([
+        semi_major_axis * (cos_e - eccentricity),
+        semi_major_axis * sqrt(1 - eccentricity**2) * sin_e,
+        zero,
+    ], axis=-1)
+    perifocal_velocities = stack([
+        -speed * sin_e,
+        speed * sqrt(1 - eccentricity**2) * cos_e,
+        zero,
+    ], axis=-1)
+
+    rotation = perifocal_matrix(
+        catalogue.long_of_ascending_node,
+        catalogue.inclination,
+        catalogue.argument_of_periapsis,
+    )
+    positions = rotate(rotation, perifocal_positions)
+    velocities = rotate(rotation, perifocal_velocities)
+    return positions, velocities
+
+
+def load_catalogue(file_path, max = 0, mmap = True, checksum = "drop",
+                   cache = False):
+    """
+    Read every element set in a two or three line TLE file. *max* caps the
+    number of satellites (0 for all of them).
+
+    With *mmap* the file is mapped rather than read, so only the pages that
+    hold element sets are touched. *checksum* says what to do with element
+    sets whose line checksums are wrong: "drop" them (counted in
+    .rejected), "raise" a ValueError, or "ignore" the checksums.
+
+    With *cache*, the catalogue comes from (or is saved to) the compiled
+    cache for the file. That is only done for the default checksum
+    handling, and a cached catalogue doesn't know how many sets were
+    rejected.
+    """
+    if cache and checksum == "drop":
+        catalogue = _load_cached(file_path, mmap)
+        if max:
+            catalogue = catalogue[:max]
+        return catalogue
+    if mmap:
+        try:
+            data = memmap(file_path, dtype=uint8, mode="r")
+        except ValueError:
+            # numpy won't map an empty file
+            data = zeros(0, dtype=uint8)
+    else:
+        data = fromfile(file_path, dtype=uint8)
+    return parse_catalogue(data, max, checksum)
+
+
+def cache_path(file_path):
+    """
+    Where the compiled cache for *file_path* (as it is now) lives.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return "%s.%s.%s%s" % (
+        file_path, digest.hexdigest()[:16], dtype(_float).name, CACHE_SUFFIX)
+
+
+def compile_catalogue(file_path):
+    """
+    Parse *file_path* and write its cache, replacing any stale ones.
+    Returns (cache path, catalogue).
+    """
+    path = cache_path(file_path)
+    catalogue = load_catalogue(file_path)
+    # Written to a temporary file and moved into place, so that a server
+    # starting at the same time never maps half a cache.
+    handle, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_path)), suffix=".npy")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            save(f, catalogue.to_records())
+        # mkstemp makes the file private; caches are for everyone who can
+        # read the TLE file, like any other new file
+        os.chmod(temporary, 0o666 & ~_umask())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    for stale in glob.glob(glob.escape(file_path) + ".*" + CACHE_SUFFIX):
+        if stale != path:
+            os.unlink(stale)
+    return path, catalogue
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _load_cached(file_path, mmap):
+    path = cache_path(file_path)
+    if os.path.exists(path):
+        try:
+            return TLECatalogue.from_records(load(path, mmap_mode="r" if mmap else None))
+        except (OSError, ValueError):
+            # Can't be read (someone else's private cache, or a damaged
+            # one), so just parse
+            return load_catalogue(file_path, mmap=mmap)
+    try:
+        _, catalogue = compile_catalogue(file_path)
+    except OSError:
+        # Nowhere to write it (a read-only install, say), so just parse
+        return load_catalogue(file_path, mmap=mmap)
+    return catalogue
+
+
+def parse_catalogue(data, max = 0, checksum = "drop"):
+    """
+    Parse TLE text (bytes, or a uint8 array) into a TLECatalogue. See
+    load_catalogue().
+    """
+    if checksum not in ("drop", "raise", "ignore"):
+        raise ValueError("checksum must be 'drop', 'raise' or 'ignore'")
+    if not hasattr(data, "dtype"):
+        data = frombuffer(data, dtype=uint8)
+    if not len(data):
+        data = frombuffer(b"\n", dtype=uint8)
+
+    # Where every line starts and ends (without its line break)
+    breaks = flatnonzero(data == ord("\n"))
+    starts = concatenate([[0], breaks + 1])
+    ends = concatenate([breaks, [len(data)]])
+    ends = where((ends > starts) & (data.take(ends - 1, mode="clip") == ord("\r")), ends - 1, ends)
+    lengths = ends - starts
+
+    # Line 1 of a set is "1 ..." and 69 characters long, followed by "2 ..."
+    first = _column(data, starts, lengths, 0)
+    second = _column(data, starts, lengths, 1)
+    is_line = (lengths >= LINE_LENGTH) & (second == ord(" "))
+    is_line1 = is_line & (first == ord("1"))
+    is_line2 = is_line & (first == ord("2"))
+    line1 = flatnonzero(is_line1[:-1] & is_line2[1:])
+
+    # Transposed to (69, N), so every column is contiguous
+    chars = {
+        1: ascontiguousarray(_characters(data, starts[line1], LINE_LENGTH).T),
+        2: ascontiguousarray(_characters(data, starts[line1 + 1], LINE_LENGTH).T),
+    }
+
+    good = ones(len(line1), dtype=bool)
+    if checksum != "ignore":
+        good = _checksum(chars[1]) & _checksum(chars[2])
+        if checksum == "raise" and not good.all():
+            raise ValueError("%d element sets fail their checksum" % (~good).sum())
+    rejected = int((~good).sum())
+    if max:
+        good &= good.cumsum() <= max
+    if not good.all():
+        line1 = line1[good]
+        chars = {line: c[:, good] for line, c in chars.items()}
+
+    # The name is the line before, unless that belongs to another set
+    has_name = (line1 > 0) & ~is_line2[line1 - 1]
+    name_starts = where(has_name, starts[line1 - 1], 0)
+    name_lengths = where(has_name, lengths[line1 - 1], 0)
+    names = _characters(data, name_starts, NAME_LENGTH, name_lengths).T
+
+    columns = {
+        name: _number(chars[line], lo, hi)
+        for name, (line, lo, hi) in _NUMBERS.items()
+    }
+    for name, lo in _EXPONENTS.items():
+        columns[name] = _exponent(chars[1], lo)
+    for name in _ANGLES:
+        columns[name] *= RAD
+
+    # Eccentricity has an implied leading decimal point
+    columns["eccentricity"] = _number(chars[2], 26, 33) / _float("1e7")
+    columns["mean_motion"] = 86400 / columns.pop("revolutions_per_day")
+
+    year = columns.pop("epoch_year").astype(int)
+    year = where(year < 57, 2000 + year, 1900 + year)
+    day = columns.pop("epoch_day")
+    microseconds = ((day - 1) * 86400e6).astype(float64).round().astype("int64")
+    columns["epoch"] = (year - 1970).astype("datetime64[Y]").astype("datetime64[us]") + \
+        microseconds.astype("timedelta64[us]")
+    columns["element_set_number"] = columns["element_set_number"].astype(int)
+
+    columns["name"] = _strings(_field(names, 0, NAME_LENGTH))
+    columns["satellite_number"] = _strings(_field(chars[1], 2, 7))
+    columns["classification"] = _strings(_field(chars[1], 7, 8))
+    columns["international_designator"] = _strings(_field(chars[1], 9, 17))
+    columns["rejected"] = rejected
+    return TLECatalogue(**columns)
+
+
+def _column(data, starts, lengths, i):
+    """
+    Character *i* of every line (0 where the line is shorter).
+    """
+    return where(lengths > i, data.take(starts + i, mode="clip"), 0)
+
+
+def _characters(data, starts, width, lengths = None):
+    """
+    (N, width) characters from each of *starts*. With *lengths*, rows are
+    space padded past the end of their line.
+    """
+    index = starts[:, newaxis] + arange(width)
+    if lengths is None:
+        return data.take(index)
+    valid = (arange(width) < lengths[:, newaxis]) & (index < len(data))
+    return where(valid, data.take(index, mode="clip"), uint8(ord(" ")))
+
+
+def _field(chars, lo, hi):
+    """
+    Columns lo:hi of every row as an (N,) byte string array.
+    """
+    return ascontiguousarray(chars[lo:hi].T).view("S%d" % (hi - lo)).ravel()
+
+
+def _number(chars, lo, hi):
+    """
+    Columns lo:hi as a number for every set. Every field of a well formed
+    TLE has its decimal point (if any) in the same column on every line, so
+    the digits can be added up as one integer dot product, then scaled once
+    by the number of digits after the point; that rounds the same way as
+    parsing the text would. A "-" anywhere makes the field negative, and
+    blanks count as 0.
+    """
+    block = chars[lo:hi]
+    is_point = block == ord(".")
+    points = flatnonzero(is_point.all(1))
+    if len(points) > 1 or (not len(points) and is_point.any()):
+        # The point moves around, so let NumPy parse the text instead
+        return _field(chars, lo, hi).astype(_float)
+
+    width = hi - lo
+    places = arange(width - 1, -1, -1)
+    after = 0
+    if len(points):
+        after = width - 1 - points[0]
+        places -= arange(width) < points[0]
+
+    digits = block - uint8(ord("0"))
+    digits = where(digits <= 9, digits, uint8(0)).astype("int64")
+    value = (10**places) @ digits
+    sign = where((block == ord("-")).any(0), -1, 1)
+    return sign * value.astype(_float) / _float(10)**after
+
+
+def _exponent(chars, lo):
+    """
+    Decode the "-12345-6" (-0.12345e-6) style fields.
+    """
+    mantissa = _number(chars, lo, lo + 6) / _float("1e5")
+    exponent = _number(chars, lo + 6, lo + 8).astype(int)
+    return mantissa * _float(10)**exponent
+
+
+def _checksum(chars):
+    """
+    True for every line whose last digit is the sum of its other digits
+    (with "-" counting as 1), modulo 10.
+    """
+    digits = chars - uint8(ord("0"))
+    values = where(digits <= 9, digits, 0) + (chars == ord("-"))
+    return values[:LINE_LENGTH - 1].sum(0) % 10 == digits[LINE_LENGTH - 1]
+
+
+def _strings(field):
+    return char.strip(field).astype(str)
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build compiled caches for TLE files.")
+    parser.add_argument("paths", nargs="*", help="TLE files (default: data/celestrak/*.txt)")
+    args = parser.parse_args()
+
+    for file_path in args.paths or sorted(glob.glob("data/celestrak/*.txt")):
+        start = time.time()
+        path, catalogue = compile_catalogue(file_path)
+        print("%s: %d satellites (%d rejected) in %.3fs -> %s" % (
+            file_path, len(catalogue), catalogue.rejected, time.time() - start, path))
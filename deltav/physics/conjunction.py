@@ -0,0 +1,399 @@
+"""
+Conjunction screening: which pairs of orbits pass within some distance of
+each other over the next few hours.
+
+Every pair gets the cheapest test that can rule it out, the way operational
+screening does it:
+
+1. Apogee/perigee filter: if the ranges of radius (periapsis to apoapsis) of
+   two orbits are further apart than the screening distance, they can never
+   meet. Pairs come out of a sweep over those ranges, so the list of all N²
+   pairs is never made.
+
+2. Geometry filter: two inclined orbits can only meet close to the line
+   where their planes cross. If their radii near both of those crossings
+   (over the stretch of orbit that is within the screening distance of the
+   other plane) are too far apart, they can't meet either.
+
+3. Sampling: what is left is propagated at regular steps over the horizon,
+   and each step is checked with closest_approach() along the cubic arcs
+   between samples.
+
+4. Refinement: each hit is polished with Newton steps on r·v = 0 using the
+   exact two-body motion of both orbits, which gives the time of closest
+   approach (TCA) and the miss distance.
+
+Screener runs this on a worker pool and yields conjunctions as they are
+found, so a long horizon can be screened while the game goes on.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from numpy import (
+    pi, sqrt, cos, arcsin, arctan2, cross,
+    arange, repeat, tile, cumsum, searchsorted, argsort, lexsort, unique,
+    concatenate, stack, asarray, ones, minimum, maximum, clip, where,
+    errstate,
+)
+
+from deltav.physics.helpers import _float, ACCURACY
+from deltav.physics.approach import closest_approach
+from deltav.physics.batch import BatchPropagator
+
+
+# Sample step: the fastest turning orbit in the screen moves this far around
+# its parent between samples (see BaseScene.WARP_ANGLE).
+SAMPLE_ANGLE = 2 * pi / 64
+
+# Newton steps when refining a time of closest approach
+ITERATIONS = 4
+
+
+def _norm(v):
+    return sqrt((v**2).sum(-1))
+
+
+class Conjunction(object):
+    """
+    Orbits *first* and *second* (indices into the list that was screened)
+    passing *distance* meters apart, *time* seconds from the start of the
+    screen, at *speed* m/s relative to each other.
+    """
+
+    def __init__(self, first, second, time, distance, speed):
+        self.first = first
+        self.second = second
+        self.time = time
+        self.distance = distance
+        self.speed = speed
+
+    def __repr__(self):
+        return "<Conjunction %d-%d t=%.0fs %.0fm at %.0fm/s>" % (
+            self.first, self.second, self.time, self.distance, self.speed)
+
+
+def apsis_filter(propagator, distance, groups = None):
+    """
+    Every pair of rows whose radius ranges come within *distance* of each
+    other, as (first, second) arrays with first < second, sorted. Only rows
+    in the same *group* (e.g. with the same parent) are paired, if given.
+    """
+    periapsis, apoapsis = propagator.apsides()
+    lo, hi = periapsis - distance / 2, apoapsis + distance / 2
+
+    # Sorted by lo, a range overlaps each of the ones after it that start
+    # before it ends
+    order = argsort(lo, kind="stable")
+    lo, hi = lo[order], hi[order]
+    start = arange(len(lo)) + 1
+    counts = maximum(searchsorted(lo, hi, side="right") - start, 0)
+    offsets = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts)
+    a = order[repeat(arange(len(lo)), counts)]
+    b = order[repeat(start, counts) + offsets]
+    first, second = minimum(a, b), maximum(a, b)
+
+    if groups is not None:
+        groups = asarray(groups)
+        same = groups[first] == groups[second]
+        first, second = first[same], second[same]
+    order = lexsort((second, first))
+    return first[order], second[order]
+
+
+def geometry_filter(propagator, first, second, distance):
+    """
+    Mask of the pairs that the orbit geometry doesn't rule out.
+
+    A point of orbit 1 within *distance* of orbit 2 is within that distance
+    of orbit 2's plane, so its argument of latitude from the line of nodes
+    u is within arcsin(distance / (r sin I)) of 0 or 180°. The same goes
+    for orbit 2. The pair is ruled out if, at both nodes, the radii the two
+    orbits have over those windows are more than *distance* apart. Only
+    applies to elliptical orbits; other pairs always pass.
+    """
+    keep = ones(len(first), dtype=bool)
+    elliptical = (propagator.alpha[first] > ACCURACY) & (propagator.alpha[second] > ACCURACY)
+    first, second = first[elliptical], second[elliptical]
+    if not len(first):
+        return keep
+
+    w1 = cross(propagator.r0[first], propagator.v0[first])
+    w2 = cross(propagator.r0[second], propagator.v0[second])
+    nodes = cross(w1 / _norm(w1)[:, None], w2 / _norm(w2)[:, None])
+    sin_i = _norm(nodes)
+
+    far = ones(len(first), dtype=bool)
+    ranges = []
+    with errstate(divide="ignore", invalid="ignore"):
+        nodes = nodes / sin_i[:, None]
+        for rows in (first, second):
+            p, q = propagator.p[rows], propagator.q[rows]
+            e, a = propagator.ecc[rows], propagator.sma[rows]
+            node = arctan2((nodes * q).sum(-1), (nodes * p).sum(-1))
+            window = arcsin(minimum(1, distance / (a * (1 - e) * sin_i)))
+            ranges.append([
+                _radius_range(a * (1 - e**2), e, node + turn, window)
+                for turn in (0, pi)
+            ])
+    for (lo1, hi1), (lo2, hi2) in zip(*ranges):
+        far &= maximum(lo1 - hi2, lo2 - hi1) > distance
+
+    keep[elliptical] = ~far
+    return keep
+
+
+def _radius_range(p, e, centre, window):
+    """
+    Least and greatest radius of an ellipse (semi-latus rectum *p*,
+    eccentricity *e*) within *window* of true anomaly *centre*. The radius
+    only turns round at periapsis and apoapsis, so it is the ends of the
+    window, unless one of those is inside it.
+    """
+    ends = p / (1 + e * cos(stack([centre - window, centre + window])))
+    lo, hi = ends.min(0), ends.max(0)
+    lo = where(_angle(centre) <= window, p / (1 + e), lo)
+    hi = where(_angle(centre - pi) <= window, p / (1 - e), hi)
+    return lo, hi
+
+
+def _angle(theta):
+    """
+    Size of an angle, wrapped to [0, π].
+    """
+    return abs((theta + pi) % (2 * pi) - pi)
+
+
+def candidates(propagator, distance, groups = None):
+    """
+    The pairs that get through both filters, as (first, second) arrays.
+    """
+    first, second = apsis_filter(propagator, distance, groups)
+    keep = geometry_filter(propagator, first, second, distance)
+    return first[keep], second[keep]
+
+
+def sample_step(propagator, rows):
+    """
+    Default sample step for screening *rows* (see SAMPLE_ANGLE).
+    """
+    if not len(rows):
+        return _float(60)
+    return SAMPLE_ANGLE / propagator.periapsis_rate(rows).max()
+
+
+def screen(propagator, first, second, start, end, distance, step):
+    """
+    Conjunctions closer than *distance* between each pair of rows (first[k],
+    second[k]), from *start* to *end* seconds after each row's current
+    t_delta, sampling every *step* seconds. A closest approach is a local
+    minimum of the distance, so a pair that is already close and moving
+    apart at *start* doesn't count.
+
+    Returns (first, second, time, distance, speed) arrays, in order of time.
+    """
+    first, second = asarray(first, dtype=int), asarray(second, dtype=int)
+    rows, inverse = unique(concatenate([first, second]), return_inverse=True)
+    a, b = inverse[:len(first)], inverse[len(first):]
+
+    times = concatenate([arange(start, end, step, dtype=_float), [_float(end)]])
+    n_rows, n_times = len(rows), len(times)
+    lanes = tile(rows, n_times)
+    positions, velocities, _ = propagator.propagate(
+        propagator.t_delta[lanes] + repeat(times, n_rows), rows=lanes)
+    positions = positions.reshape(n_times, n_rows, 3)
+    velocities = velocities.reshape(n_times, n_rows, 3)
+
+    # The cubic arcs between samples are off by up to step**4/384 times the
+    # fourth derivative of the path (as in EphemerisTable, with 1 + e <= 2),
+    # so widen the search by that much and leave the rest to refinement.
+    periapsis, _ = propagator.apsides(rows)
+    rate = propagator.periapsis_rate(rows)
+    slack = step**4 * propagator.mu[rows] / periapsis**2 * rate**2 / 96
+
+    # One lane per pair per interval
+    n_pairs, n_intervals = len(first), n_times - 1
+    k = repeat(arange(n_intervals), n_pairs)
+    pair = tile(arange(n_pairs), n_intervals)
+    i, j = a[pair], b[pair]
+    lo, hi = times[k], times[k + 1]
+    t, miss = closest_approach(
+        positions[k, i], velocities[k, i], positions[k + 1, i], velocities[k + 1, i],
+        positions[k, j], velocities[k, j], positions[k + 1, j], velocities[k + 1, j],
+        hi - lo, within=distance + slack[i] + slack[j],
+    )
+    # A closest approach at either end of an interval is really in the one
+    # next to it (or before the start, or after the end)
+    t = lo + t
+    hit = (miss <= distance + slack[i] + slack[j]) & (t > lo) & (t < hi)
+    pair, t, lo, hi = pair[hit], t[hit], lo[hit], hi[hit]
+
+    t, miss, speed = _refine(propagator, first[pair], second[pair], t, lo, hi)
+    hit = miss <= distance
+    pair, t, miss, speed = pair[hit], t[hit], miss[hit], speed[hit]
+
+    # Neighbouring intervals can both find the same approach
+    order = lexsort((t, pair))
+    pair, t, miss, speed = pair[order], t[order], miss[order], speed[order]
+    new = ones(len(pair), dtype=bool)
+    new[1:] = (pair[1:] != pair[:-1]) | (t[1:] - t[:-1] >= step / 2)
+    pair, t, miss, speed = pair[new], t[new], miss[new], speed[new]
+
+    order = lexsort((pair, t))
+    pair = pair[order]
+    return first[pair], second[pair], t[order], miss[order], speed[order]
+
+
+def _refine(propagator, first, second, t, lo, hi):
+    """
+    Newton steps on d/dt |r|²/2 = r·v = 0, whose derivative is v·v + r·a,
+    for the exact relative motion of each pair. Returns the polished times,
+    kept within [lo, hi], and the distance and relative speed there.
+    """
+    for _ in range(ITERATIONS):
+        r, v, acceleration = _relative(propagator, first, second, t)
+        g = (r * v).sum(-1)
+        g1 = (v * v).sum(-1) + (r * acceleration).sum(-1)
+        with errstate(divide="ignore", invalid="ignore"):
+            t = clip(t - where(g1 > 0, g / g1, 0), lo, hi)
+    r, v, _ = _relative(propagator, first, second, t)
+    return t, _norm(r), _norm(v)
+
+
+def _relative(propagator, first, second, t):
+    """
+    Position, velocity and acceleration of each *first* row relative to its
+    *second* row, *t* seconds on.
+    """
+    states = []
+    for rows in (first, second):
+        p, v, _ = propagator.propagate(propagator.t_delta[rows] + t, rows=rows)
+        acceleration = -propagator.mu[rows][:, None] * p / _norm(p)[:, None]**3
+        states.append((p, v, acceleration))
+    (p1, v1, a1), (p2, v2, a2) = states
+    return p1 - p2, v1 - v2, a1 - a2
+
+
+class Screener(object):
+    """
+    Screens a list of orbits on a worker pool:
+
+        screener = Screener()
+        for conjunction in screener.run(orbits, 6 * 3600, 5000):
+            warn(orbits[conjunction.first], orbits[conjunction.second])
+
+    The horizon is cut into windows of *window* seconds, and the candidate
+    pairs into chunks of *chunk*, one task each. Each task gets a copy of
+    just the rows it needs. Conjunctions come out a window at a time, in
+    order of time, while the next window is being worked on.
+
+    Any concurrent.futures executor will do. The default is a process pool:
+    screening is lots of small NumPy operations, which hold the GIL for too
+    much of the time to share a process with the sim thread.
+    """
+
+    def __init__(self, workers = None, executor = None, window = 3600, chunk = 4096):
+        self.executor = executor or ProcessPoolExecutor(workers)
+        self.window = window
+        self.chunk = chunk
+
+    def run(self, orbits, horizon, distance, step = None):
+        """
+        Yield a Conjunction for every time two of *orbits* (around the same
+        parent) pass within *distance* meters of each other in the next
+        *horizon* seconds. Samples every *step* seconds (see sample_step()
+        for the default).
+
+        Must be called from the thread that owns the orbits, since it takes
+        a snapshot of their current state (the rest runs on the pool).
+        """
+        orbits = list(orbits)
+        propagator = BatchPropagator.from_orbits(orbits)
+        parents = {}
+        groups = [parents.setdefault(id(orbit.parent), len(parents)) for orbit in orbits]
+        first, second = candidates(propagator, distance, groups)
+        if step is None:
+            step = sample_step(propagator, unique(concatenate([first, second])))
+
+        chunks = []
+        for lo in range(0, len(first), self.chunk):
+            f, s = first[lo:lo + self.chunk], second[lo:lo + self.chunk]
+            rows, inverse = unique(concatenate([f, s]), return_inverse=True)
+            chunks.append((rows, propagator.take(rows), inverse[:len(f)], inverse[len(f):]))
+
+        # Keep one window queued up while the last one is handed out
+        pending = []
+        start = 0
+        while start < horizon:
+            end = min(start + self.window, horizon)
+            pending.append(self._submit(chunks, start, end, distance, step))
+            start = end
+            if len(pending) > 1:
+                for conjunction in self._collect(pending.pop(0)):
+                    yield conjunction
+        for tasks in pending:
+            for conjunction in self._collect(tasks):
+                yield conjunction
+
+    def _submit(self, chunks, start, end, distance, step):
+        return [
+            (rows, self.executor.submit(screen, sub, f, s, start, end, distance, step))
+            for rows, sub, f, s in chunks
+        ]
+
+    def _collect(self, tasks):
+        """
+        Gather a window's tasks (in the order they were submitted, so the
+        result doesn't depend on which finished first), in order of time.
+        """
+        results = []
+        for rows, future in tasks:
+            first, second, time, distance, speed = future.result()
+            results.append((rows[first], rows[second], time, distance, speed))
+        if not results:
+            return []
+        first, second, time, distance, speed = [concatenate(column) for column in zip(*results)]
+        order = lexsort((second, first, time))
+        return [
+            Conjunction(int(first[k]), int(second[k]), time[k], distance[k], speed[k])
+            for k in order
+        ]
+
+    def shutdown(self, wait = True):
+        self.executor.shutdown(wait)
+
+
+if __name__ == "__main__":
+    #
+    # Screen a TLE catalogue for a day
+    #
+    import sys
+    import time
+
+    from deltav.physics.body import Body
+    from deltav.physics.catalogue import load_catalogue, state_vectors
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/celestrak/geo.txt"
+    distance = float(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    earth = Body(5.972e24, 6371000)
+    orbits = []
+    for position, velocity in zip(*state_vectors(load_catalogue(path), earth)):
+        body = Body(15000, 10)
+        body.orbit(earth, position, velocity)
+        orbits.append(body._orbit)
+
+    propagator = BatchPropagator.from_orbits(orbits)
+    pairs = len(orbits) * (len(orbits) - 1) // 2
+    first, second = apsis_filter(propagator, distance)
+    kept = geometry_filter(propagator, first, second, distance).sum()
+    print("%d orbits, %d pairs, %d after apogee/perigee, %d after geometry"
+          % (len(orbits), pairs, len(first), kept))
+
+    screener = Screener()
+    t = time.time()
+    found = 0
+    for conjunction in screener.run(orbits, 86400, distance):
+        found += 1
+        print(conjunction)
+    screener.shutdown()
+    print("%d conjunctions within %dm in a day, %.2fs" % (found, distance, time.time() - t))
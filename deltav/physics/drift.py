@@ -0,0 +1,143 @@
+"""
+Measure how far positions drift under each physics precision.
+
+The float type is picked once, when deltav.physics.helpers is imported (see
+deltav.configure.PHYSICS_PRECISION), so each mode is run in a fresh
+interpreter with DELTAV_PRECISION set, and the results are compared against
+the longdouble run:
+
+    python -m deltav.physics.drift [tle file] [--days N] [--count N] [--modes ...]
+
+Two things are measured for every orbit in the catalogue:
+
+    coast   -- the scene tick: BatchPropagator.step(1) once per game second,
+               then one propagate() at the end. Rounding error builds up in
+               t_delta.
+    rebase  -- a zero burn every hour (Orbit.accelerate), the way ships reset
+               their epoch. Rounding error builds up in the epoch state.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+
+from numpy import zeros, load, save, stack, median, nan
+from numpy.linalg import norm
+
+
+REFERENCE = "longdouble"
+# float32 is for rendering only, but can be asked for with --modes to see why
+MODES = ("longdouble", "float64")
+
+REBASE_INTERVAL = 3600
+
+
+def _orbits(path, count):
+    from deltav.physics.body import Body
+    from deltav.physics.orbit import Orbit
+    from deltav.physics.util import load_tle_file
+
+    earth = Body(5.972e24, 6371000)
+    orbits = []
+    for tle in load_tle_file(path, max=count):
+        body = Body(15000, 10)
+        body.orbit(earth, *Orbit.vecs_from_tle(tle, earth, body))
+        orbits.append(body._orbit)
+    return orbits
+
+
+def run(path, days, count):
+    """
+    Run both scenarios with whatever precision this interpreter has.
+    Returns ({scenario: (N, 3) positions}, {scenario: seconds}).
+    """
+    from deltav.physics.batch import BatchPropagator
+
+    seconds = int(days * 86400)
+    positions = {}
+    elapsed = {}
+
+    orbits = _orbits(path, count)
+    batch = BatchPropagator.from_orbits(orbits)
+    t = time.time()
+    for _ in range(seconds):
+        batch.step(1)
+    positions["coast"], _, _ = batch.propagate()
+    elapsed["coast"] = time.time() - t
+
+    orbits = _orbits(path, count)
+    t = time.time()
+    for orbit in orbits:
+        for _ in range(seconds // REBASE_INTERVAL):
+            orbit.step(REBASE_INTERVAL)
+            orbit.accelerate(zeros(3))
+        orbit.step(seconds % REBASE_INTERVAL)
+    positions["rebase"] = stack([orbit.get_position()[0] for orbit in orbits])
+    elapsed["rebase"] = time.time() - t
+
+    return positions, elapsed
+
+
+def compare(path, days, count, modes = MODES):
+    """
+    Run every mode in a subprocess. Returns a list of
+    (mode, scenario, max drift, median drift, seconds) rows, drift in meters
+    from the reference mode. A mode that blows up gets a single row with
+    scenario "failed".
+    """
+    if REFERENCE not in modes:
+        modes = (REFERENCE,) + tuple(modes)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            out = os.path.join(tmp, mode)
+            env = dict(os.environ, DELTAV_PRECISION=mode)
+            proc = subprocess.run(
+                [sys.executable, "-m", "deltav.physics.drift", path,
+                 "--days", str(days), "--count", str(count), "--child", out],
+                env=env, stdout=subprocess.PIPE,
+            )
+            if proc.returncode:
+                results[mode] = None
+                continue
+            elapsed = json.loads(proc.stdout.decode().splitlines()[-1])
+            positions = {s: load(out + "." + s + ".npy") for s in elapsed}
+            results[mode] = positions, elapsed
+
+    reference, _ = results[REFERENCE]
+    rows = []
+    for mode in modes:
+        if results[mode] is None:
+            rows.append((mode, "failed", nan, nan, nan))
+            continue
+        positions, elapsed = results[mode]
+        for scenario in sorted(positions):
+            drift = norm(positions[scenario] - reference[scenario], axis=1)
+            rows.append((mode, scenario, drift.max(), median(drift), elapsed[scenario]))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("path", nargs="?", default="data/celestrak/geo.txt")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--modes", nargs="+", default=MODES)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        positions, elapsed = run(args.path, args.days, args.count)
+        for scenario, value in positions.items():
+            # float64 is plenty to tell the modes apart at this scale
+            save(args.child + "." + scenario + ".npy", value.astype(float))
+        print(json.dumps(elapsed))
+    else:
+        print("%d orbits from %s, %g days" % (args.count, args.path, args.days))
+        print("%-12s %-8s %14s %14s %10s" % ("mode", "scenario", "max (m)", "median (m)", "time (s)"))
+        for row in compare(args.path, args.days, args.count, args.modes):
+            print("%-12s %-8s %14.6g %14.6g %10.3f" % row)
@@ -0,0 +1,105 @@
+"""
+Ephemeris tables for coasting orbits.
+
+An elliptical orbit that isn't maneuvering repeats itself every period, so
+it can be sampled once (position, velocity and acceleration at evenly spaced
+times over one period) and looked up from then on by cubic Hermite
+interpolation between the two neighbouring samples. That is a handful of
+multiply-adds per lookup, for any number of times at once, instead of a
+Kepler solve each.
+
+Orbit.ephemeris builds the table the first time it is asked for, and
+Orbit._reset_epoch throws it away, so it is never used across a burn. Very
+eccentric orbits would need more than MAX_SAMPLES samples to keep to the
+tolerance; they get no table, and are solved exactly instead.
+"""
+
+from numpy import sqrt, ceil, floor, arange, clip, newaxis, errstate
+
+from deltav.physics.helpers import _float, array
+from deltav.physics.approach import hermite
+from deltav.physics.batch import BatchPropagator
+
+
+MIN_SAMPLES = 64
+MAX_SAMPLES = 4096
+
+
+def table_size(elements, tolerance):
+    """
+    Number of samples an EphemerisTable of an elliptical orbit with
+    *elements* needs, or None if that is more than MAX_SAMPLES.
+    """
+    a = elements.semi_major_axis
+    e = elements.eccentricity
+    r_p = a * (1 - e)
+    v_p = sqrt(elements.mu * (1 + e) / r_p)
+    bound = elements.mu / r_p**2 * (v_p / r_p)**2 * (1 + e)**2
+    step = (384 * tolerance / bound)**_float("0.25")
+    samples = ceil(elements.period / step)
+    if samples > MAX_SAMPLES:
+        return None
+    return max(int(samples), MIN_SAMPLES)
+
+
+class EphemerisTable(object):
+    """
+    Samples of one elliptical orbit over a period. Times are by the orbit's
+    own clock (seconds since its zero epoch, like Orbit.t_delta).
+
+    The number of samples is picked so that interpolated positions are
+    within about *tolerance* meters of the exact solution. The error of a
+    cubic Hermite step of length h is at most h**4/384 times the largest
+    fourth derivative of the path, which is around periapsis: roughly
+    (gravity there) * (angular rate there)**2, and a bit more than that for
+    eccentric orbits, where the distance changes quickly too.
+    """
+
+    def __init__(self, orbit, tolerance = _float("1e-3")):
+        el = orbit.elements
+        if not el.is_elliptical:
+            raise ValueError("Only elliptical orbits repeat")
+        samples = table_size(el, tolerance)
+        if samples is None:
+            raise ValueError("Orbit is too eccentric for a table")
+
+        self.period = el.period
+        self.tolerance = tolerance
+        self.samples = samples
+        self.step = self.period / self.samples
+
+        # One extra sample at the end (the same as the first), so that every
+        # interval has a right hand neighbour.
+        times = arange(self.samples + 1) * self.step
+        propagator = BatchPropagator.from_orbits([orbit])
+        rows = times.astype(int) * 0
+        self.position, self.velocity, _ = propagator.propagate(times, rows=rows)
+        r = sqrt((self.position**2).sum(-1))[:, newaxis]
+        self.acceleration = -el.mu * self.position / r**3
+
+    def __len__(self):
+        return self.samples
+
+    def at(self, times):
+        """
+        Interpolated (positions, velocities) at each of *times*, as (N, 3)
+        arrays (or (3,) arrays for a scalar time).
+        """
+        times = array(times)
+        scalar = times.ndim == 0
+        times = times.reshape(-1) % self.period
+
+        with errstate(invalid="ignore"):
+            k = floor(times / self.step).astype(int)
+        k = clip(k, 0, self.samples - 1)
+        s = ((times - k * self.step) / self.step)[:, newaxis]
+
+        p0, p1 = self.position[k], self.position[k + 1]
+        v0, v1 = self.velocity[k], self.velocity[k + 1]
+        a0, a1 = self.acceleration[k], self.acceleration[k + 1]
+
+        positions = hermite(p0, v0, p1, v1, self.step, s)
+        velocities = hermite(v0, a0, v1, a1, self.step, s)
+        if scalar:
+            return positions[0], velocities[0]
+        return positions, velocities
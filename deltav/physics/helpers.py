@@ -1,16 +1,30 @@
 
+from collections import OrderedDict
 from functools import partial
 
-from numpy import longdouble, seterr, sqrt, sin, cos, tan, matrix
+from numpy import longdouble, float64, float32, finfo, sqrt, sin, cos, tan, sign
 from numpy import array as _array
 
-seterr(all="raise")
+import deltav.configure
+
+PRECISIONS = {
+    "longdouble": longdouble,
+    "float64": float64,
+    "float32": float32,
+}
 
 # set the float type for all physics calculations
-_float = longdouble
+_float = PRECISIONS[deltav.configure.PHYSICS_PRECISION]
+
+# and for anything that only ends up on screen
+_render_float = PRECISIONS[deltav.configure.RENDER_PRECISION]
 
 array = partial(_array, dtype=_float)
 
+# Convergence tolerance for the iterative solvers. 1e-12 is only reachable
+# with extended precision, so coarser float types get a looser bound.
+ACCURACY = max(_float("1e-12"), 64 * finfo(_float).eps)
+
 
 def cbrt(x):
     return x**(1/_float("3.0"))
@@ -36,6 +50,49 @@ def cached_property(f):
     return property(get)
 
 
+class LRUCache(object):
+    """
+    Dict-like cache that holds at most *maxsize* entries, dropping the least
+    recently used one when full. Keeps hit/miss counts, so callers can see
+    whether it is doing any good.
+    """
+
+    def __init__(self, maxsize = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __repr__(self):
+        return "<LRUCache %d/%d hits=%d misses=%d>" % (
+            len(self._data), self.maxsize, self.hits, self.misses)
+
+    def get(self, key, default = None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
 def distance(p1, p2):
     return sqrt(
         (p1[0]-p2[0])**2 +
@@ -43,52 +100,39 @@ def distance(p1, p2):
         (p1[2]-p2[2])**2
     )
 
-# From Paul Griffith's Pyastro library
-def kepler(m_anom, eccentricity, accuracy = 1e-12):
+# Started out as the Newton solver from Paul Griffith's Pyastro library
+def kepler(m_anom, eccentricity, accuracy = ACCURACY):
 
     """Solves Kepler's equation for the eccentric anomaly
-    using Newton's method.
+    using Halley's method.
     Arguments:
     m_anom -- mean anomaly in radians
     eccentricity -- eccentricity of the ellipse
     Returns: eccentric anomaly in radians.
     """
 
-    e_anom = m_anom
+    e_anom = kepler_starter(m_anom, eccentricity)
 
-    while True:
-        diff = e_anom - eccentricity * sin(e_anom) - m_anom
-        e_anom -= diff / (1 - eccentricity * cos(e_anom))
+    for _ in range(50):
+        e_sin = eccentricity * sin(e_anom)
+        e_cos = eccentricity * cos(e_anom)
+        diff = e_anom - e_sin - m_anom
+        d1 = 1 - e_cos
+        e_anom -= diff / (d1 - diff * e_sin / (2 * d1))
         if abs(diff) <= accuracy:
             break
     return e_anom
 
-def Rx(theta):
-    """
-    Return a rotation matrix for the X axis and angle *theta*
-    """
-    return matrix([
-        [1, 0,          0          ],
-        [0, cos(theta), sin(theta)],
-        [0, -sin(theta), cos(theta) ],
-    ], dtype=_float)
-
-def Ry(theta):
-    """
-    Return a rotation matrix for the Y axis and angle *theta*
-    """
-    return matrix([
-        [cos(theta),  0, sin(theta)],
-        [0,           1, 0         ],
-        [-sin(theta), 0, cos(theta)],
-    ], dtype=_float)
-    
-def Rz(theta):
+def kepler_starter(m_anom, eccentricity):
     """
-    Return a rotation matrix for the Z axis and angle *theta*
+    Initial guess for the eccentric anomaly. The third order series in e is
+    all but exact for near-circular orbits; Danby's starter is used for
+    everything else, because it stays in the right basin for any e < 1.
     """
-    return matrix([
-        [cos(theta), sin(theta), 0],
-        [-sin(theta), cos(theta),  0],
-        [0,          0,           1],
-    ], dtype=_float)
\ No newline at end of file
+    sin_m = sin(m_anom)
+    if eccentricity < 0.3:
+        cos_m = cos(m_anom)
+        return m_anom + eccentricity * sin_m + \
+            eccentricity**2 * sin_m * cos_m + \
+            eccentricity**3 * sin_m * (cos_m**2 - sin_m**2 / 2)
+    return m_anom + _float("0.85") * eccentricity * sign(sin_m)
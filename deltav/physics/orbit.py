@@ -3,6 +3,7 @@ Two-body Keplarian orbit modelling.
 """
 
 from math import floor
+from operator import attrgetter
 from numpy import (
     isnan,
     cross,
@@ -15,15 +16,108 @@ from numpy import (
     tan, arctan, arctan2,
     dot,
     log,
-    newaxis, squeeze, asarray,
-    seterr,
+    newaxis, stack, zeros_like, arange,
+    clip,
+    errstate,
 )
 from numpy.linalg import norm
 
-seterr(all="raise")
-
 from deltav.physics.helpers import cached_property, _float, array, cbrt, cot, \
-    kepler, Rz, Rx
+    kepler, ACCURACY, LRUCache
+from deltav.physics.rotation import perifocal_matrix, rotate
+
+
+class OrbitalElements(object):
+    """
+    The derived quantities Orbit uses all the time, worked out together from
+    one epoch state. An instance never changes: Orbit makes a new one when
+    its epoch is reset.
+
+        mu                          standard gravitational parameter (μ)
+        sqrt_mu                     √μ
+        mag_position, mag_velocity  |r|, |v|
+        dot_rv                      r·v
+        specific_mechanical_energy  (ξ)
+        v_angular_momentum          h' in m**2/s, and its magnitude h
+        angular_momentum
+        v_eccentricity              e', and its magnitude e (0 if circular)
+        eccentricity
+        alpha                       1/a (0 if parabolic)
+        semi_major_axis             a (inf if parabolic)
+        is_parabolic, is_hyperbolic, is_elliptical
+
+    And for elliptical orbits only (None otherwise):
+
+        period, mean_motion         P in seconds, n = 2π/P
+        perifocal_basis             unit vectors (P, Q): P points at
+                                    periapsis (or the epoch position, if
+                                    circular), Q is 90° ahead of it
+        mean_anomaly_at_epoch       M0, measured from P
+        b                           √(1 - e²)
+        sqrt_mu_a                   √(μa)
+    """
+
+    __slots__ = (
+        "mu", "sqrt_mu", "mag_position", "mag_velocity", "dot_rv",
+        "specific_mechanical_energy", "v_angular_momentum", "angular_momentum",
+        "v_eccentricity", "eccentricity", "alpha", "semi_major_axis",
+        "is_parabolic", "is_hyperbolic", "is_elliptical",
+        "period", "mean_motion", "perifocal_basis", "mean_anomaly_at_epoch",
+        "b", "sqrt_mu_a",
+    )
+
+    def __init__(self, v_position, v_velocity, mu, accuracy):
+        self.mu = mu
+        self.sqrt_mu = sqrt(mu)
+        self.mag_position = r = norm(v_position)
+        self.mag_velocity = v = norm(v_velocity)
+        self.dot_rv = dot_rv = dot(v_position, v_velocity)
+
+        self.specific_mechanical_energy = (v**2/2) - (mu / r)
+        self.v_angular_momentum = h = cross(v_position, v_velocity)
+        self.angular_momentum = mag_h = norm(h)
+
+        self.v_eccentricity = e_vec = (1/mu) * (
+            ((v**2 - mu/r) * v_position) - (dot_rv * v_velocity)
+        )
+        e = norm(e_vec)
+        self.eccentricity = e = 0 if e < accuracy else e
+
+        alpha = -self.specific_mechanical_energy * _float("2")/mu
+        self.alpha = alpha = 0 if abs(alpha) < accuracy else alpha
+        self.is_parabolic = abs(alpha) < accuracy
+        self.is_hyperbolic = alpha < 0 and not self.is_parabolic
+        self.is_elliptical = alpha > 0 and not self.is_parabolic
+        self.semi_major_axis = a = Inf if self.is_parabolic else _float("1")/alpha
+
+        if not self.is_elliptical:
+            self.period = self.mean_motion = self.perifocal_basis = None
+            self.mean_anomaly_at_epoch = self.b = self.sqrt_mu_a = None
+            return
+
+        self.period = 2 * pi * sqrt(abs(a)**3 / mu)
+        self.mean_motion = 2*pi/self.period
+        self.b = sqrt(1 - e**2)
+        self.sqrt_mu_a = sqrt(mu * a)
+
+        # A radial trajectory (h = 0) has no orbital plane. Let its basis be
+        # nan rather than stop the orbit being created at all.
+        with errstate(divide="ignore", invalid="ignore"):
+            p = e_vec / e if e else v_position / r
+            self.perifocal_basis = p, cross(h / mag_h, p)
+
+        if e:
+            eccentric_anomaly = arctan2(dot_rv / self.sqrt_mu_a, 1 - r * alpha)
+            self.mean_anomaly_at_epoch = eccentric_anomaly - e * sin(eccentric_anomaly)
+        else:
+            self.mean_anomaly_at_epoch = _float("0")
+
+
+def _element(name):
+    """
+    Read-only Orbit attribute backed by the same field of Orbit.elements.
+    """
+    return property(attrgetter("elements." + name))
 
 
 class Orbit(object):
@@ -46,7 +140,22 @@ class Orbit(object):
     K = array([0, 0, 1])
 
     # Used for comparisons, because of floating point rounding error
-    ACCURACY = _float("1e-12")
+    ACCURACY = ACCURACY
+
+    # Newton-Raphson can't always get within ACCURACY once rounding error
+    # is bigger than that (chi is in units of sqrt(m)), so stop eventually.
+    MAX_ITERATIONS = 50
+
+    # Solved positions are kept in a bounded LRU cache per orbit. Epochs are
+    # rounded to a multiple of POSITIONS_CACHE_QUANTUM seconds first (0 means
+    # no rounding), so that lookups which are nearly the same time share an
+    # entry.
+    POSITIONS_CACHE_SIZE = 64
+    POSITIONS_CACHE_QUANTUM = 0
+
+    # How close (in meters) positions_at() lookups from the ephemeris table
+    # have to stay to the exact solution.
+    EPHEMERIS_TOLERANCE = _float("1e-3")
 
 
     def __init__(self, parent, satellite, v_position, v_velocity):
@@ -62,7 +171,9 @@ class Orbit(object):
         self.v_velocity = array(v_velocity)
 
         self._property_cache = {}
-        self._positions_cache = {}
+        self._positions_cache = LRUCache(self.POSITIONS_CACHE_SIZE)
+        self._ephemeris = None
+        self._update_elements()
 
         self.t_delta = _float("0")
 
@@ -81,41 +192,86 @@ class Orbit(object):
            zero epoch.
         """
         current_v_position, current_v_velocity = self.get_position()
-        # set velocity
-        self.v_velocity = current_v_velocity + vec
-        # set new position
-        self.v_position = current_v_position
-        # reset epoch
-        self.t_delta = 0
-        # clear cache
-        self._property_cache = {}
-        self._positions_cache = {}
-
+        self._reset_epoch(current_v_position, current_v_velocity + vec)
 
 
     def set_veloctiy(self, v_velocity):
-        self.accelerate(0)
-        self.v_velocity = v_velocity
+        current_v_position, _ = self.get_position()
+        self._reset_epoch(current_v_position, array(v_velocity))
 
 
-    # Often used
+    def _reset_epoch(self, v_position, v_velocity):
+        # set new position and velocity
+        self.v_position = v_position
+        self.v_velocity = v_velocity
+        # reset epoch
+        self.t_delta = _float("0")
+        # clear cache
+        self._property_cache = {}
+        self._positions_cache.clear()
+        self._ephemeris = None
+        self._update_elements()
+        # let whoever is tracking our satellite know (i.e. the scene store)
+        try:
+            notify = self.satellite._orbit_changed
+        except AttributeError:
+            return
+        notify()
 
 
-    @cached_property
-    def mag_position(self):
-        return norm(self.v_position)
+    def _update_elements(self):
+        """
+        Work out the orbital elements for the current epoch state. Anything
+        that changes v_position or v_velocity must call this.
+        """
+        self.elements = OrbitalElements(
+            self.v_position, self.v_velocity,
+            self.G * self.parent.mass, self.ACCURACY,
+        )
 
-    @cached_property
-    def mag_velocity(self):
-        return norm(self.v_velocity)
 
-    
+    # Often used. These are all read from self.elements, which is worked out
+    # in one pass whenever the epoch is reset (see OrbitalElements).
+
+    mag_position = _element("mag_position")
+    mag_velocity = _element("mag_velocity")
+    gravitational_parameter = _element("mu")
+    specific_mechanical_energy = _element("specific_mechanical_energy")
+    v_angular_momentum = _element("v_angular_momentum")
+    angular_momentum = _element("angular_momentum")
+    v_eccentricity = _element("v_eccentricity")
+    eccentricity = _element("eccentricity")
+    _alpha = _element("alpha")
+    semi_major_axis = _element("semi_major_axis")
+    period = _element("period")
+    mean_motion = _element("mean_motion")
+    perifocal_basis = _element("perifocal_basis")
+    mean_anomaly_at_epoch = _element("mean_anomaly_at_epoch")
+    is_parabolic = _element("is_parabolic")
+    is_hyperbolic = _element("is_hyperbolic")
+    is_elliptical = _element("is_elliptical")
+
     # Define properties for the classical orbital elements
 
     @cached_property
     def true_anomaly(self):
-        v = arccos(dot(self.v_eccentricity, self.v_position)/(self.eccentricity * self.mag_position))
-        if dot(self.v_position, self.v_velocity) < 0:
+        if self.eccentricity:
+            reference = self.v_eccentricity
+            past_half = dot(self.v_position, self.v_velocity) < 0
+        else:
+            # Circular orbits have no periapsis, so measure from the ascending
+            # node instead (argument of latitude), or from the x axis if the
+            # orbit is equatorial too (true longitude).
+            reference = self.v_ascending_node
+            if self.is_equatorial:
+                past_half = self.v_position[1] < 0
+            else:
+                past_half = self.v_position[2] < 0
+        v = arccos(clip(
+            dot(reference, self.v_position)/(norm(reference) * self.mag_position),
+            -1, 1
+        ))
+        if past_half:
             v = 2*pi - v
         return v
 
@@ -136,7 +292,7 @@ class Orbit(object):
         """
         Longitude of the ascending node (Ω)
         """
-        l = arccos(self.v_ascending_node[0]/norm(self.v_ascending_node))
+        l = arccos(clip(self.v_ascending_node[0]/norm(self.v_ascending_node), -1, 1))
         if abs(self.v_ascending_node[1]) < self.ACCURACY:
             l = 2*pi - l
         return l
@@ -145,139 +301,57 @@ class Orbit(object):
     @cached_property
     def argument_of_periapsis(self):
         """
-        Argument of periapsis (ω)
+        Argument of periapsis (ω). Zero for circular orbits, by convention.
         """
-        omega = arccos(
+        if not self.eccentricity:
+            return _float("0")
+        omega = arccos(clip(
             dot(self.v_ascending_node, self.v_eccentricity)
             /
-            (norm(self.v_ascending_node) * self.eccentricity)
-        )
+            (norm(self.v_ascending_node) * self.eccentricity),
+            -1, 1
+        ))
         if self.v_eccentricity[2] < 0:
             omega = 2*pi - omega
         return omega
 
 
-    @cached_property
-    def gravitational_parameter(self):
-        """
-        Standard gravitational parameter of the parent body. (μ)
-        """
-        return self.G * self.parent.mass
-
-
-    @cached_property
-    def specific_mechanical_energy(self):
-        """
-        Specific mechanical energy of the orbit (ξ)
-        """
-        return (self.mag_velocity**2/2) - (self.gravitational_parameter / self.mag_position)
-
-
-    @cached_property
-    def v_angular_momentum(self):
-        """
-        Angular momentum vector, in m**2/s (h')
-        """
-        return cross(self.v_position, self.v_velocity)
-
-
-    @cached_property
-    def angular_momentum(self):
-        """
-        Magnitude of h'. (h)
-        """
-        return norm(self.v_angular_momentum)
-
-
-    @cached_property
-    def v_eccentricity(self):
-        """
-        Eccentricity vector. (e')
-        """
-        return (
-            1/self.gravitational_parameter
-        ) * (
-            ((self.mag_velocity**2 - self.gravitational_parameter/self.mag_position) * self.v_position)
-            -
-            (dot(self.v_position, self.v_velocity) * self.v_velocity)
-        )
-
-
     @cached_property
     def eccentric_anomaly(self):
         """
         Eccentric anomaly (E)
         """
-        e = arctan(
-            (sqrt(1 - self.eccentricity**2) * sin(self.true_anomaly))
-            /
-            (self.eccentricity + cos(self.true_anomaly))
-        )
+        # e + cos(v) can be exactly 0, where arctan(±inf) is the right answer
+        with errstate(divide="ignore"):
+            e = arctan(
+                (sqrt(1 - self.eccentricity**2) * sin(self.true_anomaly))
+                /
+                (self.eccentricity + cos(self.true_anomaly))
+            )
         e %= 2*pi
         return e
 
     @cached_property
-    def eccentricity(self):
-        """
-        The eccentricity of the orbital ellipse. (e)
-        """
-        e = norm(self.v_eccentricity)
-        if e < self.ACCURACY:
-            return 0
-        else:
-            return e
-
-
-    @cached_property
-    def _alpha(self):
-        """
-        Used solely for calculation purposes.
-        """
-        alpha = -self.specific_mechanical_energy * _float("2")/self.gravitational_parameter
-        if abs(alpha) < self.ACCURACY:
-            return 0
-        return alpha
-
-
-    @cached_property
-    def semi_major_axis(self):
-        """
-        Calculate the semi-major axis (a).
-        """
-        if not self.is_parabolic:
-            return _float("1")/self._alpha
-        else:
-            return Inf
-
-
-    @cached_property
-    def period(self):
+    def semi_latus_rectum(self):
         """
-        The orbital period in seconds. (P)
+        Return the semi-latus rectum for the current orbit (p). Uses h²/μ
+        rather than a(1 - e²), which is inf * 0 for parabolic orbits.
         """
-        if self.is_elliptical:
-            return 2 * pi * sqrt(
-                abs(self.semi_major_axis)**3 / self.gravitational_parameter
-            )
-        else:
-            return None
-
-    @cached_property
-    def mean_motion(self):
-        return 2*pi/self.period
+        return self.angular_momentum**2 / self.gravitational_parameter
 
 
     @cached_property
-    def semi_latus_rectum(self):
+    def perifocal_matrix(self):
         """
-        Return the semi-latus rectum for the current orbit (p).
+        Rotation from perifocal coordinates to the parent's frame (see
+        rotation.perifocal_matrix), built once per epoch.
         """
-        return self.semi_major_axis * (1 - self.eccentricity**2)
-
+        return perifocal_matrix(
+            self.long_of_ascending_node, self.inclination, self.argument_of_periapsis)
 
     @cached_property
     def inclination(self):
-        return arccos(self.v_angular_momentum[2]/norm(self.v_angular_momentum))
+        return arccos(clip(self.v_angular_momentum[2]/norm(self.v_angular_momentum), -1, 1))
    
 
     def _stumpff(self, psi):
@@ -316,95 +390,206 @@ class Orbit(object):
         delta_seconds = _float(delta_seconds) # should be passed in as an integer
         self.t_delta += delta_seconds
 
+    def _epoch_key(self, delta_seconds = None):
+        """
+        Normalize a time delta the same way get_position does, so it can be
+        used to look up (or fill) the positions cache.
+        """
+        if delta_seconds is None:
+            delta_seconds = self.t_delta
+
+        # Only matters for elliptical orbits.
+        period = self.elements.period
+        if period is not None:
+            delta_seconds = delta_seconds % period
+
+        if self.POSITIONS_CACHE_QUANTUM:
+            quantum = self.POSITIONS_CACHE_QUANTUM
+            delta_seconds = floor(delta_seconds / quantum + _float("0.5")) * quantum
+
+        return delta_seconds
+
+    def prime_position(self, v_position, v_velocity, delta_seconds = None):
+        """
+        Store a position/velocity computed elsewhere (e.g. by a
+        BatchPropagator) so that the next get_position call for the same
+        epoch doesn't have to solve for it again.
+        """
+        key = self._epoch_key(delta_seconds)
+        self._positions_cache[key] = (v_position, v_velocity)
+
+    @property
+    def ephemeris(self):
+        """
+        EphemerisTable for this orbit, built the first time it is needed and
+        dropped when the epoch is reset. None unless the orbit is elliptical,
+        and not so eccentric that the table would be too big.
+        """
+        if self._ephemeris is None and self.elements.is_elliptical:
+            # Imported here because the ephemeris module needs Orbit itself
+            from deltav.physics.ephemeris import EphemerisTable, table_size
+            if table_size(self.elements, self.EPHEMERIS_TOLERANCE) is not None:
+                self._ephemeris = EphemerisTable(self, self.EPHEMERIS_TOLERANCE)
+        return self._ephemeris
+
+    def positions_at(self, delta_seconds):
+        """
+        Positions and velocities at many epochs at once, as (N, 3) arrays
+        (or (3,) arrays for a scalar time). Orbits with an ephemeris table
+        interpolate from it, which is within EPHEMERIS_TOLERANCE meters of
+        get_position(). Anything else is solved exactly.
+        """
+        ephemeris = self.ephemeris
+        if ephemeris is not None:
+            return ephemeris.at(delta_seconds)
+        from deltav.physics.batch import BatchPropagator
+        delta_seconds = array(delta_seconds)
+        scalar = delta_seconds.ndim == 0
+        delta_seconds = delta_seconds.reshape(-1)
+        rows = (delta_seconds * 0).astype(int)
+        positions, velocities, _ = BatchPropagator.from_orbits([self]).propagate(
+            delta_seconds, rows=rows)
+        if scalar:
+            return positions[0], velocities[0]
+        return positions, velocities
+
     def get_position(self, delta_seconds = None):
         """
         Get the current position. If delta_seconds is passed, it will be used
-        as the epoch for the calculation.
+        as the epoch for the calculation (rounded to POSITIONS_CACHE_QUANTUM).
 
-        Extremely large time deltas have the potential to slow down the
-        Newton-Raphson integration (see the while loop). But at least in the
+        Elliptical orbits are solved in closed form. Everything else goes
+        through the universal variable formulation, where extremely large time
+        deltas have the potential to slow down the Newton-Raphson integration
+        (see the while loop in _universal_position). But at least in the
         case of spacecraft, we don't ever expect the time deltas to grow very
         large (because the zero epoch for them will be reset on each
         acceleration).
         """
-        if delta_seconds is None:
-            delta_seconds = self.t_delta
+        delta_seconds = self._epoch_key(delta_seconds)
 
-        # Only matters for elliptical orbits.
-        if self.period is not None:
-            delta_seconds = delta_seconds % self.period
+        cached = self._positions_cache.get(delta_seconds)
+        if cached is not None:
+            return cached
+
+        # A single orbit that can't be solved is a bug in the caller (or a
+        # degenerate orbit), so say so rather than returning nan. Underflow
+        # is harmless.
+        with errstate(divide="raise", over="raise", invalid="raise"):
+            if self.elements.is_elliptical:
+                v_position, v_velocity = self._elliptical_position(delta_seconds)
+            else:
+                v_position, v_velocity = self._universal_position(delta_seconds)
+
+        self._positions_cache[delta_seconds] = (v_position, v_velocity)
 
-        if delta_seconds in self._positions_cache:
-            return self._positions_cache[delta_seconds]
+        return v_position, v_velocity
+
+
+    def _elliptical_position(self, delta_seconds):
+        """
+        Closed form position and velocity for elliptical orbits: advance the
+        mean anomaly, solve Kepler's equation, and place the result in the
+        perifocal frame.
+        """
+        el = self.elements
+        e = el.eccentricity
+        a = el.semi_major_axis
+        b = el.b
+        p, q = el.perifocal_basis
 
+        mean_anomaly = el.mean_anomaly_at_epoch + el.mean_motion * delta_seconds
+        eccentric_anomaly = kepler(mean_anomaly, e, self.ACCURACY)
+
+        cos_e = cos(eccentric_anomaly)
+        sin_e = sin(eccentric_anomaly)
+
+        v_position = a * (cos_e - e) * p + a * b * sin_e * q
+
+        mag_position = a * (1 - e * cos_e)
+        v_velocity = (el.sqrt_mu_a / mag_position) * (
+            -sin_e * p + b * cos_e * q
+        )
+
+        return v_position, v_velocity
+
+
+    def _universal_position(self, delta_seconds):
         #
         # Determine a new position and velocity, given a delta-t in seconds,
-        # using the universal variable formulation.
+        # using the universal variable formulation. Works for any kind of
+        # orbit, but is only used for hyperbolic and parabolic ones.
         #
         # This routine is based on the "kepler" function from the as2body.cpp
         # implementation available here: https://celestrak.com/software/vallado-sw.asp
         # and the 2nd edition of the book (§2.2 up to p. 101).
         #
 
-        _dot_rv = dot(self.v_position, self.v_velocity) # convenience variable
+        el = self.elements
+        alpha = el.alpha
+        mag_r0 = el.mag_position
+        _dot_rv = el.dot_rv # convenience variable
+        _sqrt_mu = el.sqrt_mu
 
-        if self.is_elliptical:
+        if el.is_elliptical:
 
-            chi = sqrt(self.gravitational_parameter) * delta_seconds * self._alpha
+            chi = _sqrt_mu * delta_seconds * alpha
 
-            if abs(self._alpha) - 1 < self.ACCURACY:
+            if abs(alpha) - 1 < self.ACCURACY:
                 # Fuzz the guess. This number taken from the source code. But if
                 # the initial value is too close, then (so I am told), it will
                 # not converge in the integration step.
                 chi *= _float("0.97")
 
-        elif self.is_parabolic:
+        elif el.is_parabolic:
 
             _s = (
                 (pi/2) - arctan(
                     delta_seconds * 3 * sqrt(
-                        self.gravitational_parameter / self.semi_latus_rectum**3
+                        el.mu / self.semi_latus_rectum**3
                     )
                 )
             ) / 2
             _w = arctan(tan(_s)**(_float("1")/_float("3")))
             chi = sqrt(self.semi_latus_rectum) * (2 * cot(2 * _w))
 
-        elif self.is_hyperbolic: # hyperbolic
+        elif el.is_hyperbolic: # hyperbolic
 
-            _num = (-2 * self.gravitational_parameter * delta_seconds * self._alpha) / (
-                _dot_rv + sign(delta_seconds) * sqrt(-self.gravitational_parameter * self.semi_major_axis) *
-                (1 - self.mag_position * self._alpha)
+            # Taking delta_seconds = 0 as forwards, so the denominator can't
+            # vanish at periapsis (where _dot_rv is 0 too).
+            _num = (-2 * el.mu * delta_seconds * alpha) / (
+                _dot_rv + (-1 if delta_seconds < 0 else 1) * sqrt(-el.mu * el.semi_major_axis) *
+                (1 - mag_r0 * alpha)
             )
 
             if _num < self.ACCURACY:
                 _num = self.ACCURACY
 
-            chi = sign(delta_seconds) * sqrt(-self.semi_major_axis) * log(_num)
+            chi = sign(delta_seconds) * sqrt(-el.semi_major_axis) * log(_num)
 
         else:
             raise Exception("Wrong spacetime")
 
         iterations = 0
         _chi = chi + _float("1") # placeholder value to make the first check pass
-        while abs(chi - _chi) > self.ACCURACY:
+        while abs(chi - _chi) > self.ACCURACY and iterations < self.MAX_ITERATIONS:
 
             iterations += 1
 
-            psi = chi**2 * self._alpha # greek alphabet soup
+            psi = chi**2 * alpha # greek alphabet soup
 
             c2, c3 = self._stumpff(psi)
 
             _r = chi**2 * c2 +  \
-                (_dot_rv/sqrt(self.gravitational_parameter)) * chi * (1 - psi*c3) + \
-                self.mag_position * (1 - psi*c2)
+                (_dot_rv/_sqrt_mu) * chi * (1 - psi*c3) + \
+                mag_r0 * (1 - psi*c2)
 
             chi_ = chi + \
                 (
-                    sqrt(self.gravitational_parameter) * delta_seconds -
+                    _sqrt_mu * delta_seconds -
                     chi**3 * c3 -
-                    _dot_rv/sqrt(self.gravitational_parameter) * chi**2 * c2 -
-                    self.mag_position * chi * (1 - psi*c3)
+                    _dot_rv/_sqrt_mu * chi**2 * c2 -
+                    mag_r0 * chi * (1 - psi*c3)
                 ) / _r
 
             # TODO: adjustments for circular orbits or large (> 2pi * sqrt(a))
@@ -415,13 +600,13 @@ class Orbit(object):
             chi = chi_
 
         if iterations == 0:
-            psi = chi**2 * self._alpha
+            psi = chi**2 * alpha
             c2, c3 = self._stumpff(psi)
 
         # At long last, we calculate the new position and velocity
 
-        f = 1 - (chi**2 * c2 / self.mag_position)
-        g = delta_seconds - chi**3 * c3/sqrt(self.gravitational_parameter)
+        f = 1 - (chi**2 * c2 / mag_r0)
+        g = delta_seconds - chi**3 * c3/_sqrt_mu
 
         v_position = array([
             (f * self.v_position[i] + g * self.v_velocity[i]) for i in range(3)
@@ -429,14 +614,12 @@ class Orbit(object):
 
         mag_position = norm(v_position)
         g_dot = 1 - (chi**2 * c2/mag_position)
-        f_dot = (sqrt(self.gravitational_parameter) * chi / (self.mag_position * mag_position)) * (psi * c3 - 1)
+        f_dot = (_sqrt_mu * chi / (mag_r0 * mag_position)) * (psi * c3 - 1)
 
         v_velocity = array([
             (f_dot * self.v_position[i] + g_dot * self.v_velocity[i]) for i in range(3)
         ])
 
-        self._positions_cache[delta_seconds] = (v_position, v_velocity)
-
         return v_position, v_velocity
 
 
@@ -478,7 +661,7 @@ class Orbit(object):
         y = None
         while abs(delta_t - time) > self.ACCURACY and iterations < 100:
             y = mag_p1 + mag_p2 + ((A*(psi_n*c3-1))/sqrt(c2))
-            if A > 0 and y < 0:
+            if y < 0:
                 raise ValueError("adjust psi_low so y > 0 (%s)" % y)
             chi = sqrt(y/c2)
             
@@ -535,11 +718,8 @@ class Orbit(object):
         points = []
         n = 36
         if self.is_elliptical:
-            start, limit, step = 0, 2*pi, 2*pi/n
-            while start < limit:
-                position, _ = self.position_from_true_anomaly(start)
-                start += step
-                points.append(position)
+            positions, _ = self.position_from_true_anomaly(arange(n) * (2*pi/n))
+            points.extend(positions)
         else:
             max_ = 5.0
             start, limit, step = max_, 0, -max_/(n/2)
@@ -563,16 +743,8 @@ class Orbit(object):
     #
 
     @cached_property
-    def is_parabolic(self):
-        return abs(self._alpha) < self.ACCURACY
-
-    @cached_property
-    def is_hyperbolic(self):
-        return self._alpha < 0 and not self.is_parabolic
-
-    @cached_property
-    def is_elliptical(self):
-        return self._alpha > 0 and not self.is_parabolic
+    def is_equatorial(self):
+        return norm(cross(self.K, self.v_angular_momentum)) < self.ACCURACY
 
     @classmethod
     def _reverse(cls,
@@ -581,35 +753,30 @@ class Orbit(object):
         eccentricity,
         gravitational_parameter,
         semi_major_axis,
-        long_of_ascending_node,
-        inclination,
-        argument_of_periapsis,
+        rotation,
     ):
-
+        """
+        Position and velocity at the given anomalies (scalars, or arrays for
+        (N, 3) results), with *rotation* the orbit's perifocal_matrix.
+        """
+        true_anomaly = array(true_anomaly)
+        eccentric_anomaly = array(eccentric_anomaly)
         r_distance = semi_major_axis * (1 - eccentricity * cos(eccentric_anomaly))
+        zero = zeros_like(true_anomaly)
 
-        pos_orbital = r_distance * array([
+        pos_orbital = r_distance[..., newaxis] * stack([
             cos(true_anomaly),
             sin(true_anomaly),
-            0,
-        ])
+            zero,
+        ], axis=-1)
 
-        vel_orbital = sqrt(gravitational_parameter*semi_major_axis)/r_distance * array([
+        vel_orbital = (sqrt(gravitational_parameter*semi_major_axis)/r_distance)[..., newaxis] * stack([
             -sin(eccentric_anomaly),
             sqrt(1 - eccentricity**2) * cos(eccentric_anomaly),
-            0,
-        ])
-
-        v_position = cls._rotate(pos_orbital, long_of_ascending_node, inclination, argument_of_periapsis)
-        v_velocity = cls._rotate(vel_orbital, long_of_ascending_node, inclination, argument_of_periapsis)
-
-        return v_position, v_velocity
+            zero,
+        ], axis=-1)
 
-    @classmethod
-    def _rotate(cls, r, Ω, ι, ω):
-        r = r[:, newaxis]
-        r = (Rz(-Ω)*Rx(-ι)*Rz(-ω)).dot(r)
-        return squeeze(asarray(r))
+        return rotate(rotation, pos_orbital), rotate(rotation, vel_orbital)
 
     @classmethod
     def vecs_from_tle(cls, tle, parent, satellite, epoch = None):
@@ -620,8 +787,8 @@ class Orbit(object):
         # FIXME: make dates Julian
         delta_t = 0
         if epoch:
-            interval = tle["epoch"] - epoch
-            delta_t = interval.seconds + interval.days * 86400
+            # Seconds from the element set's epoch on to the one asked for
+            delta_t = (epoch - tle["epoch"]).total_seconds()
 
         gravitational_parameter = cls.G * parent.mass
         semi_major_axis = cbrt((tle["mean_motion"]/(2*pi))**2*gravitational_parameter)
@@ -643,32 +810,34 @@ class Orbit(object):
             eccentricity, 
             gravitational_parameter, 
             semi_major_axis, 
-            tle["long_of_ascending_node"], 
-            tle["inclination"], 
-            tle["argument_of_periapsis"]
+            perifocal_matrix(
+                tle["long_of_ascending_node"],
+                tle["inclination"],
+                tle["argument_of_periapsis"],
+            ),
         )
 
 
     def position_from_true_anomaly(self, true_anomaly):
         """
-        Get a position based on a value for the true anomaly
+        Get a position based on a value for the true anomaly (or (N, 3)
+        positions for an array of them)
         """
-
-        eccentric_anomaly = arccos(
-            (self.eccentricity+cos(true_anomaly))
-            /
-            (1 + self.eccentricity*cos(true_anomaly))
+        e = self.eccentricity
+        # Half angle form, so the eccentric anomaly is on the same side of
+        # the orbit as the true anomaly (and the velocity points the right way)
+        eccentric_anomaly = 2 * arctan2(
+            sqrt(1 - e) * sin(array(true_anomaly)/2),
+            sqrt(1 + e) * cos(array(true_anomaly)/2),
         )
 
         p, v = self._reverse(
             true_anomaly,
             eccentric_anomaly, 
-            self.eccentricity, 
+            e, 
             self.gravitational_parameter, 
             self.semi_major_axis, 
-            self.long_of_ascending_node, 
-            self.inclination, 
-            self.argument_of_periapsis
+            self.perifocal_matrix,
         )
 
         return p, v
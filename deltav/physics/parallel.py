@@ -0,0 +1,180 @@
+"""
+Propagation on worker processes.
+
+SharedPropagator is a BatchPropagator whose columns are kept in shared memory
+blocks (multiprocessing.shared_memory), along with the rows to solve and the
+arrays the answers go in. propagate() cuts the rows into one contiguous chunk
+per worker, and each worker maps the blocks, solves its chunk with the plain
+BatchPropagator code, and writes the answers straight into its own part of
+the output. Nothing but the block names and the chunk bounds is pickled.
+
+Every lane is solved on its own (Kepler iterations are masked per lane), so
+which chunk a row lands in makes no difference to its answer, and the merged
+result is the same as a single process would get, to the bit.
+
+Scenes use one by setting BaseScene.PROPAGATOR:
+
+    class BigMap(BaseScene):
+        PROPAGATOR = functools.partial(SharedPropagator, workers=4)
+"""
+
+import os
+import weakref
+
+from ctypes import c_char
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from numpy import ndarray, dtype, intp, prod
+
+from deltav.physics.helpers import _float
+from deltav.physics.batch import BatchPropagator
+
+
+# Answers for the rows of a propagate() call: (name, dtype, vector)
+_OUTPUTS = (
+    ("rows", intp, False),
+    ("positions", _float, True),
+    ("velocities", _float, True),
+    ("valid", bool, False),
+)
+
+
+class SharedPropagator(BatchPropagator):
+    """
+    BatchPropagator that solves on *workers* processes (the CPU count by
+    default). Calls with fewer than *min_rows* rows, or with their own
+    *delta_seconds*, aren't worth sending out and are solved here as usual.
+
+    Call close() when done with it, to stop the workers and free the shared
+    memory (this also happens when it is garbage collected).
+    """
+
+    def __init__(self, size = 0, workers = None, executor = None, min_rows = 256):
+        self._blocks = {}
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor or ProcessPoolExecutor(self.workers)
+        self.min_rows = min_rows
+        self._finalizer = weakref.finalize(self, _release, self._blocks, self.executor)
+        super(SharedPropagator, self).__init__(size)
+        self._resize_outputs(size)
+
+    def _column(self, name, shape, fill, kind = _float):
+        size = max(int(dtype(kind).itemsize * prod(shape)), 1)
+        block = SharedMemory(create=True, size=size)
+        column = _array(block, shape, kind)
+        column[...] = fill
+        old = self._blocks.get(name)
+        self._blocks[name] = block
+        if old is not None:
+            old.unlink()
+            _let_go(old)
+        return column
+
+    def resize(self, size):
+        super(SharedPropagator, self).resize(size)
+        self._resize_outputs(size)
+
+    def _resize_outputs(self, size):
+        for name, kind, vector in _OUTPUTS:
+            shape = (size, 3) if vector else (size,)
+            setattr(self, "_" + name, self._column(name, shape, 0, kind))
+
+    def layout(self):
+        """
+        Where every array is: {name: (block name, shape, dtype)}.
+        """
+        arrays = [(name, getattr(self, name)) for name, _ in self._COLUMNS]
+        arrays += [(name, getattr(self, "_" + name)) for name, _, _ in _OUTPUTS]
+        return dict(
+            (name, (self._blocks[name].name, column.shape, column.dtype.str))
+            for name, column in arrays
+        )
+
+    def propagate(self, delta_seconds = None, rows = None):
+        if rows is None or delta_seconds is not None or len(rows) < self.min_rows:
+            return super(SharedPropagator, self).propagate(delta_seconds, rows)
+
+        n = len(rows)
+        self._rows[:n] = rows
+        layout = self.layout()
+        bounds = [n * k // self.workers for k in range(self.workers + 1)]
+        tasks = [
+            self.executor.submit(_propagate_chunk, layout, lo, hi)
+            for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo
+        ]
+        # Every chunk writes only its own lanes, so the order they finish in
+        # doesn't matter; result() is just to wait (and to raise errors).
+        for task in tasks:
+            task.result()
+        return self._positions[:n].copy(), self._velocities[:n].copy(), self._valid[:n].copy()
+
+    def close(self):
+        self._finalizer()
+
+
+def _array(block, shape, kind):
+    """
+    Array over *block*. It goes through a ctypes buffer, which (unlike an
+    array made straight from block.buf) keeps a hold of the mapping for as
+    long as the array or any view of it is alive.
+    """
+    memory = (c_char * block.size).from_buffer(block.buf)
+    return ndarray(shape, dtype=kind, buffer=memory)
+
+
+def _let_go(block):
+    """
+    Close our handle on *block*, but leave the memory mapped for as long as
+    any array made over it is alive (the last of them unmaps it). Closing
+    the handle as it is would unmap the memory from under them.
+    """
+    block._buf = None
+    block._mmap = None
+    block.close()
+
+
+def _release(blocks, executor):
+    executor.shutdown(wait=True)
+    for block in blocks.values():
+        block.unlink()
+        _let_go(block)
+    blocks.clear()
+
+
+#
+# Worker side
+#
+
+# Blocks this worker has mapped, by block name
+_mapped = {}
+
+
+def _attach(layout):
+    """
+    Arrays over the blocks in *layout*, mapping any new ones and letting go
+    of any that aren't in it any more.
+    """
+    arrays = {}
+    for name, (block_name, shape, kind) in layout.items():
+        block = _mapped.get(block_name)
+        if block is None:
+            block = _mapped[block_name] = SharedMemory(block_name)
+        arrays[name] = _array(block, shape, kind)
+    current = set(block_name for block_name, _, _ in layout.values())
+    for block_name in list(_mapped):
+        if block_name not in current:
+            _let_go(_mapped.pop(block_name))
+    return arrays
+
+
+def _propagate_chunk(layout, lo, hi):
+    arrays = _attach(layout)
+    propagator = BatchPropagator()
+    for name, _ in BatchPropagator._COLUMNS:
+        setattr(propagator, name, arrays[name])
+    positions, velocities, valid = propagator.propagate(rows=arrays["rows"][lo:hi])
+    arrays["positions"][lo:hi] = positions
+    arrays["velocities"][lo:hi] = velocities
+    arrays["valid"][lo:hi] = valid
@@ -0,0 +1,311 @@
+"""
+Porkchop plots: delta-v for every pair of (departure time, time of flight).
+
+first_intercept() takes the first time of flight that works. The nav
+computer wants the cheapest (or quickest) one, so this evaluates a whole grid
+of departures x times of flight in one lambert() call, picks the optimum, and
+zooms in around it a few times to pin it down.
+
+Target positions come from an Ephemeris, which remembers every time it has
+been asked for, so replanning against the same target (or refining around the
+optimum) mostly doesn't propagate anything.
+
+Planner runs searches on a worker pool, so the sim thread only pays for
+taking a snapshot of the two orbits.
+"""
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import (
+    sqrt, floor, linspace, unique,
+    zeros, empty, full, where, isnan, nanargmin,
+    nan,
+)
+
+from deltav.physics.helpers import _float, array, LRUCache
+from deltav.physics.batch import BatchPropagator
+from deltav.physics.lambert import lambert
+
+
+def _norm(v):
+    return sqrt((v**2).sum(-1))
+
+
+class Ephemeris(object):
+    """
+    Position and velocity of one orbit at any time, by the orbit's own clock
+    (seconds since its zero epoch, like Orbit.t_delta). Times are rounded to
+    *quantum* seconds, and every solved time is kept (up to *size* of them).
+
+    Holds a snapshot of the orbit, so it is safe to use from another thread
+    while the game carries on, and goes stale as soon as the orbit is
+    changed by a burn (see Ephemeris.matches).
+    """
+
+    def __init__(self, orbit, quantum = 1, size = 65536):
+        self.propagator = BatchPropagator.from_orbits([orbit])
+        self.elements = orbit.elements
+        self.min_radius = orbit.parent.radius
+        self.quantum = quantum
+        self._cache = LRUCache(size)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def mu(self):
+        return self.propagator.mu[0]
+
+    def matches(self, orbit):
+        """
+        True if this is still a good ephemeris for *orbit*.
+        """
+        return orbit.elements is self.elements
+
+    def snap(self, times):
+        """
+        Round *times* to the ephemeris' quantum.
+        """
+        times = array(times)
+        if not self.quantum:
+            return times
+        return floor(times / self.quantum + _float("0.5")) * self.quantum
+
+    def at(self, times):
+        """
+        (positions, velocities, valid) at each of *times* (any shape), which
+        are snapped to the quantum first.
+        """
+        times = self.snap(times)
+        shape = times.shape
+        flat = times.ravel()
+        keys, inverse = unique(flat, return_inverse=True)
+
+        positions = empty((len(keys), 3), dtype=_float)
+        velocities = empty((len(keys), 3), dtype=_float)
+        valid = empty(len(keys), dtype=bool)
+        with self._lock:
+            missing = []
+            for i, key in enumerate(keys):
+                state = self._cache.get(key)
+                if state is None:
+                    missing.append(i)
+                else:
+                    positions[i], velocities[i], valid[i] = state
+            if missing:
+                rows = zeros(len(missing), dtype=int)
+                p, v, ok = self.propagator.propagate(keys[missing], rows=rows)
+                positions[missing], velocities[missing], valid[missing] = p, v, ok
+                for i, j in enumerate(missing):
+                    self._cache[keys[j]] = (p[i], v[i], ok[i])
+
+        return (
+            positions[inverse].reshape(shape + (3,)),
+            velocities[inverse].reshape(shape + (3,)),
+            valid[inverse].reshape(shape),
+        )
+
+
+class Porkchop(object):
+    """
+    Result of a search. *departures* and *times* are the grid axes (seconds
+    by the shooter's clock, and seconds of flight). delta_v[i, j] is the
+    cost of leaving at departures[i] and arriving times[j] later, or nan if
+    there is no solution. velocity[i, j] is the velocity to leave with.
+    """
+
+    def __init__(self, departures, times, delta_v, velocity):
+        self.departures = departures
+        self.times = times
+        self.delta_v = delta_v
+        self.velocity = velocity
+        # Set by search() to the refined optimum, if there is one
+        self.optimum = None
+
+    def __repr__(self):
+        return "<Porkchop %dx%d best=%r>" % (
+            len(self.departures), len(self.times), self.best)
+
+    @property
+    def best(self):
+        """
+        (departure, time of flight, delta-v, velocity) of the cheapest cell,
+        or None if no cell has a solution.
+        """
+        if isnan(self.delta_v).all():
+            return None
+        i, j = divmod(nanargmin(self.delta_v), len(self.times))
+        return self.departures[i], self.times[j], self.delta_v[i, j], self.velocity[i, j]
+
+
+def porkchop(shooter, target, departures, times, method = "izzo",
+             rendezvous = False, target_offset = 0):
+    """
+    Evaluate every (departure, time of flight) pair. *shooter* and *target*
+    are Ephemeris objects, and *departures* are by the shooter's clock. The
+    target's clock runs in step with it (they get stepped together), but
+    *target_offset* seconds ahead.
+
+    Delta-v is the burn at departure, plus the one to match velocities at
+    arrival if *rendezvous* is set. Both ways round are tried, and the
+    cheaper one is kept.
+    """
+    departures = shooter.snap(departures)
+    times = shooter.snap(times)
+    times = times[times > 0]
+    n_dep, n_tof = len(departures), len(times)
+
+    p1, v_ship, ok1 = shooter.at(departures)
+    arrivals = departures[:, None] + times[None, :] + target_offset
+    p2, v_target, ok2 = target.at(arrivals)
+
+    p1 = p1[:, None, :].repeat(n_tof, 1).reshape(-1, 3)
+    v_ship = v_ship[:, None, :].repeat(n_tof, 1).reshape(-1, 3)
+    p2 = p2.reshape(-1, 3)
+    v_target = v_target.reshape(-1, 3)
+    tof = (times[None, :] * full((n_dep, 1), 1, dtype=_float)).ravel()
+    ok = (ok1[:, None] & ok2).ravel()
+
+    best_dv = full(len(tof), nan, dtype=_float)
+    best_v = zeros((len(tof), 3), dtype=_float)
+    for tm in (1, -1):
+        v1, v2, valid = lambert(p1, p2, tof, shooter.mu, tm, shooter.min_radius, method)
+        dv = _norm(v1 - v_ship)
+        if rendezvous:
+            dv += _norm(v_target - v2)
+        better = ok & valid & ~(dv >= best_dv)
+        best_dv = where(better, dv, best_dv)
+        best_v = where(better[:, None], v1, best_v)
+
+    return Porkchop(
+        departures, times,
+        best_dv.reshape(n_dep, n_tof), best_v.reshape(n_dep, n_tof, 3),
+    )
+
+
+def search(shooter, target, departures, times, method = "izzo",
+           rendezvous = False, levels = 3, size = 9, target_offset = 0):
+    """
+    Work out the porkchop plot over the given grid, then refine its optimum
+    *levels* times, each time with a *size* x *size* grid spanning the cells
+    next to the best one so far (kept within the given grid). Returns the coarse Porkchop, with
+    .optimum set to the refined (departure, time of flight, delta-v,
+    velocity), or None.
+    """
+    departures = array(departures)
+    times = array(times)
+    coarse = porkchop(shooter, target, departures, times, method, rendezvous, target_offset)
+    best = coarse.best
+    if best is None:
+        return coarse
+
+    grid = coarse
+    d_min, d_max = coarse.departures.min(), coarse.departures.max()
+    t_min, t_max = coarse.times.min(), coarse.times.max()
+    for _ in range(levels):
+        departure, tof = best[0], best[1]
+        d_step = _spacing(grid.departures, departure)
+        t_step = _spacing(grid.times, tof)
+        if d_step <= shooter.quantum and t_step <= shooter.quantum:
+            break
+        grid = porkchop(
+            shooter, target,
+            linspace(max(departure - d_step, d_min), min(departure + d_step, d_max), size),
+            linspace(max(tof - t_step, t_min), min(tof + t_step, t_max), size),
+            method, rendezvous, target_offset,
+        )
+        refined = grid.best
+        if refined is not None and refined[2] < best[2]:
+            best = refined
+
+    coarse.optimum = best
+    return coarse
+
+
+def _spacing(axis, value):
+    """
+    Distance from *value* to its nearest neighbour on *axis*.
+    """
+    if len(axis) < 2:
+        return _float(0)
+    gaps = abs(axis - value)
+    gaps = gaps[gaps > 0]
+    return gaps.min() if len(gaps) else _float(0)
+
+
+class Planner(object):
+    """
+    Runs searches in the background. Ephemerides are kept between requests
+    (until the orbit they were made from is changed), so replanning against
+    the same target reuses everything already solved.
+
+        planner = Planner()
+        future = planner.submit(ship._orbit, target._orbit, departures, times)
+        ...
+        result = future.result()   # a Porkchop
+
+    Any concurrent.futures executor will do. The default is a thread pool:
+    NumPy does the heavy lifting with the GIL released, so the sim thread
+    keeps running.
+    """
+
+    def __init__(self, workers = 2, executor = None, quantum = 1, cache_size = 64):
+        self.executor = executor or ThreadPoolExecutor(workers)
+        self.quantum = quantum
+        self._ephemerides = LRUCache(cache_size)
+
+    def ephemeris(self, orbit):
+        """
+        Cached Ephemeris for *orbit*, or a new one if it has changed.
+        """
+        ephemeris = self._ephemerides.get(id(orbit))
+        if ephemeris is None or not ephemeris.matches(orbit):
+            ephemeris = Ephemeris(orbit, self.quantum)
+            self._ephemerides[id(orbit)] = ephemeris
+        return ephemeris
+
+    def submit(self, orbit, target, departures, times, **kwargs):
+        """
+        Search for transfers from *orbit* to *target*, leaving *departures*
+        seconds from now, with flight times *times*. Takes keyword arguments
+        as search(). Returns a Future for the Porkchop, whose departures are
+        relative to now.
+
+        Must be called from the thread that owns the orbits (the sim thread),
+        since it reads their current state.
+        """
+        shooter = self.ephemeris(orbit)
+        ephemeris = self.ephemeris(target)
+        now = _float(orbit.t_delta)
+        offset = _float(target.t_delta) - now
+        departures = array(departures)
+        return self.executor.submit(
+            _relative, now,
+            search, shooter, ephemeris, departures + now, times,
+            target_offset=offset, **kwargs
+        )
+
+    def shutdown(self, wait = True):
+        self.executor.shutdown(wait)
+
+
+def _relative(now, function, *args, **kwargs):
+    """
+    Run a search in the shooter's clock, and shift the result to be relative
+    to *now*.
+    """
+    result = function(*args, **kwargs)
+    result.departures = result.departures - now
+    if result.optimum is not None:
+        departure, tof, delta_v, velocity = result.optimum
+        result.optimum = departure - now, tof, delta_v, velocity
+    return result
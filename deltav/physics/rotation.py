@@ -0,0 +1,90 @@
+"""
+Rotation matrices as plain arrays.
+
+rx, ry and rz take an angle, or an array of angles, and return a (3, 3)
+matrix, or a (..., 3, 3) stack of them, with the same conventions as the old
+helpers.Rx/Ry/Rz (which built a numpy.matrix per call). Matrices compose
+with @, and rotate() applies one (or one per vector) to any stack of
+vectors.
+
+perifocal_matrix() is Rz(-node) @ Rx(-inclination) @ Rz(-periapsis) worked
+out in closed form: its columns are the perifocal axes (towards periapsis,
+along the motion at periapsis, and the orbit normal) in the parent's frame.
+Orbit keeps one per epoch (Orbit.perifocal_matrix).
+"""
+
+from numpy import sin, cos, stack, einsum, broadcast_arrays
+
+from deltav.physics.helpers import _float, array
+
+
+def _matrices(rows):
+    """
+    Stack three rows of three (broadcastable) entries into (..., 3, 3).
+    """
+    entries = broadcast_arrays(*[entry for row in rows for entry in row])
+    return stack([stack(entries[i:i + 3], axis=-1) for i in (0, 3, 6)], axis=-2)
+
+
+def _trig(theta):
+    theta = array(theta)
+    return sin(theta), cos(theta), _float(0), _float(1)
+
+
+def rx(theta):
+    """
+    Rotation matrix (or matrices) for the X axis and angle(s) *theta*.
+    """
+    s, c, o, l = _trig(theta)
+    return _matrices([
+        [l, o, o],
+        [o, c, s],
+        [o, -s, c],
+    ])
+
+
+def ry(theta):
+    """
+    Rotation matrix (or matrices) for the Y axis and angle(s) *theta*.
+    """
+    s, c, o, l = _trig(theta)
+    return _matrices([
+        [c, o, s],
+        [o, l, o],
+        [-s, o, c],
+    ])
+
+
+def rz(theta):
+    """
+    Rotation matrix (or matrices) for the Z axis and angle(s) *theta*.
+    """
+    s, c, o, l = _trig(theta)
+    return _matrices([
+        [c, s, o],
+        [-s, c, o],
+        [o, o, l],
+    ])
+
+
+def perifocal_matrix(long_of_ascending_node, inclination, argument_of_periapsis):
+    """
+    Matrix (or matrices) taking perifocal coordinates to the parent's frame,
+    for scalar or array elements.
+    """
+    sin_o, cos_o = sin(long_of_ascending_node), cos(long_of_ascending_node)
+    sin_i, cos_i = sin(inclination), cos(inclination)
+    sin_w, cos_w = sin(argument_of_periapsis), cos(argument_of_periapsis)
+    return _matrices([
+        [cos_o * cos_w - sin_o * sin_w * cos_i, -cos_o * sin_w - sin_o * cos_w * cos_i, sin_o * sin_i],
+        [sin_o * cos_w + cos_o * sin_w * cos_i, -sin_o * sin_w + cos_o * cos_w * cos_i, -cos_o * sin_i],
+        [sin_w * sin_i, cos_w * sin_i, cos_i],
+    ])
+
+
+def rotate(matrix, vectors):
+    """
+    Apply *matrix* (3, 3) to every vector in *vectors* (..., 3), or a stack
+    of matrices (..., 3, 3) to their matching vectors.
+    """
+    return einsum("...ij,...j->...i", matrix, vectors)
@@ -0,0 +1,347 @@
+"""
+Chebyshev-compressed trajectories.
+
+A trajectory is stored the way SPK type 2 ephemerides are: the time range is
+cut into segments, and over each segment every coordinate of the position is
+a Chebyshev series of fixed degree. Velocity is the derivative of that
+series, so it doesn't cost any storage. Segments are as long as they can be
+while staying within *tolerance* meters of the path they were fitted to,
+which for an orbit is a few hundred bytes per revolution instead of a state
+vector per tick.
+
+Recording a ship's history is one Trajectory.from_orbit() per coast, joined
+with extend():
+
+    history = Trajectory.from_orbit(ship._orbit, 3600, start=now)
+    ...  # burn
+    history.extend(Trajectory.from_orbit(ship._orbit, 7200, start=now))
+    history.save("replay.traj")
+
+    history = Trajectory.load("replay.traj")
+    positions, velocities = history.at(times)
+
+The file format is a little-endian header (see HEADER) followed by the
+count + 1 segment boundaries and then the (count, 3, degree + 1) coefficients,
+all as float64. load() maps the file rather than reading it, so opening a
+long history is free, and tobytes()/frombytes() give the same layout for
+sending one over the wire.
+"""
+
+import struct
+
+from numpy import (
+    pi, cos, sqrt, arange, newaxis,
+    concatenate, searchsorted, clip, zeros, empty, einsum,
+    memmap, frombuffer, fromfile, ascontiguousarray,
+)
+from numpy.polynomial.chebyshev import chebder
+
+from deltav.physics.helpers import _float, array
+
+
+MAGIC = b"DVTRAJ"
+VERSION = 1
+# magic, version, degree, segment count
+HEADER = struct.Struct("<6sHHI2x")
+FORMAT = "<f8"
+
+DEGREE = 12
+TOLERANCE = _float("1")
+# Never split below this many seconds, however badly a segment fits
+MIN_SPAN = _float("1")
+
+
+class Trajectory(object):
+    """
+    Positions over a time range, as Chebyshev series over consecutive
+    segments. *breaks* are the count + 1 segment boundaries (seconds, in
+    increasing order) and *coefficients* is (count, 3, degree + 1).
+    """
+
+    def __init__(self, breaks, coefficients):
+        self.breaks = breaks
+        self.coefficients = coefficients
+        self._derivatives = None
+
+    def __len__(self):
+        return len(self.coefficients)
+
+    def __repr__(self):
+        return "<Trajectory %d segments %s-%s>" % (len(self), self.start, self.end)
+
+    @property
+    def degree(self):
+        return self.coefficients.shape[-1] - 1
+
+    @property
+    def start(self):
+        return self.breaks[0]
+
+    @property
+    def end(self):
+        return self.breaks[-1]
+
+    @property
+    def nbytes(self):
+        return HEADER.size + 8 * (len(self.breaks) + self.coefficients.size)
+
+    @classmethod
+    def fit(cls, function, start, end, tolerance = TOLERANCE, degree = DEGREE,
+            max_span = None):
+        """
+        Fit *function* (times -> (N, 3) positions) from *start* to *end*.
+
+        Every segment is interpolated at the Chebyshev nodes of its degree
+        and checked at the points half way between them (and its ends); if
+        it misses any of those by more than *tolerance* meters it is cut in
+        half and both halves are tried again. All the segments waiting to be
+        fitted are sampled with one call, so *function* should be
+        vectorized.
+        """
+        start, end = _float(start), _float(end)
+        if not end > start:
+            raise ValueError("A trajectory needs end > start")
+        span = end - start
+        if max_span is None or max_span >= span:
+            pieces = 1
+        else:
+            pieces = int(-(-span // max_span))
+
+        nodes, basis = _nodes(degree)
+        checks = _checks(nodes)
+        check_basis = _basis(checks, degree)
+        n_nodes, n_checks = len(nodes), len(checks)
+
+        edges = start + arange(pieces + 1) * (span / pieces)
+        edges[-1] = end
+        lo, hi = edges[:-1], edges[1:]
+        done_lo, done_coefficients = [], []
+        while len(lo):
+            mid, half = (hi + lo) / 2, (hi - lo) / 2
+            x = concatenate([nodes, checks])
+            times = mid[:, newaxis] + half[:, newaxis] * x
+            positions = function(times.ravel()).reshape(len(lo), n_nodes + n_checks, 3)
+
+            coefficients = einsum("jk,skc->scj", basis, positions[:, :n_nodes])
+            fitted = einsum("scj,jk->skc", coefficients, check_basis)
+            miss = sqrt(((fitted - positions[:, n_nodes:])**2).sum(-1)).max(-1)
+
+            good = (miss <= tolerance) | (hi - lo <= 2 * MIN_SPAN)
+            done_lo.append(lo[good])
+            done_coefficients.append(coefficients[good])
+            lo, mid, hi = lo[~good], mid[~good], hi[~good]
+            lo, hi = concatenate([lo, mid]), concatenate([mid, hi])
+
+        lo = concatenate(done_lo)
+        order = lo.argsort()
+        breaks = concatenate([lo[order], [end]])
+        return cls(breaks, concatenate(done_coefficients)[order])
+
+    @classmethod
+    def from_orbit(cls, orbit, duration, start = 0, tolerance = TOLERANCE,
+                   degree = DEGREE):
+        """
+        Fit *orbit* for *duration* seconds from its current epoch. The
+        trajectory's clock reads *start* at that epoch.
+
+        Positions come from a BatchPropagator over the orbit, which is the
+        same solution as Orbit.get_position, for all the sample times at once.
+        """
+        # Imported here because the batch module needs Orbit itself
+        from deltav.physics.batch import BatchPropagator
+
+        propagator = BatchPropagator.from_orbits([orbit])
+        offset = _float(orbit.t_delta) - _float(start)
+
+        def function(times):
+            rows = zeros(len(times), dtype=int)
+            positions, _, _ = propagator.propagate(times + offset, rows=rows)
+            return positions
+
+        # An elliptical orbit repeats, so keep segments to half a period to
+        # make sure no fit can line up with the orbit by luck.
+        period = orbit.elements.period
+        max_span = None if period is None else period / 2
+        return cls.fit(function, start, _float(start) + duration, tolerance,
+                       degree, max_span)
+
+    def extend(self, other):
+        """
+        Append *other*, which must have the same degree and start no later
+        than this one ends (anything of this one after other.start is
+        dropped).
+        """
+        if other.degree != self.degree:
+            raise ValueError("Can't join trajectories of degree %d and %d"
+                             % (self.degree, other.degree))
+        if not self.start <= other.start <= self.end:
+            raise ValueError("Can't extend a trajectory with a gap")
+        keep = searchsorted(self.breaks, other.start, side="left")
+        self.breaks = concatenate([self.breaks[:keep], other.breaks])
+        self.coefficients = concatenate([self.coefficients[:keep], other.coefficients])
+        self._derivatives = None
+
+    def _segments(self, times):
+        """
+        Segment index and position within it (-1 to 1) for every time.
+        """
+        i = clip(searchsorted(self.breaks, times, side="right") - 1, 0, len(self) - 1)
+        lo, hi = self.breaks[i], self.breaks[i + 1]
+        return i, (2 * times - lo - hi) / (hi - lo), hi - lo
+
+    def at(self, times):
+        """
+        Positions and velocities at each of *times*, as (N, 3) arrays (or
+        (3,) arrays for a scalar time). Times outside the trajectory are
+        extrapolated from its first or last segment.
+        """
+        times = array(times)
+        scalar = times.ndim == 0
+        times = times.reshape(-1)
+
+        if self._derivatives is None:
+            self._derivatives = chebder(self.coefficients, axis=-1)
+        i, x, span = self._segments(times)
+        positions = _clenshaw(self.coefficients[i], x)
+        # d/dt = d/dx * dx/dt
+        velocities = _clenshaw(self._derivatives[i], x) * (2 / span)[:, newaxis]
+        if scalar:
+            return positions[0], velocities[0]
+        return positions, velocities
+
+    def tobytes(self):
+        header = HEADER.pack(MAGIC, VERSION, self.degree, len(self))
+        return header + \
+            ascontiguousarray(self.breaks, dtype=FORMAT).tobytes() + \
+            ascontiguousarray(self.coefficients, dtype=FORMAT).tobytes()
+
+    @classmethod
+    def frombytes(cls, data):
+        degree, count = _header(data[:HEADER.size])
+        values = frombuffer(data, dtype=FORMAT, offset=HEADER.size)
+        return cls._from_values(values, degree, count)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.tobytes())
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        """
+        Open a saved trajectory. With *mmap*, the arrays are read-only views
+        of the file, paged in as they are used.
+        """
+        with open(path, "rb") as f:
+            degree, count = _header(f.read(HEADER.size))
+            if not mmap:
+                values = fromfile(f, dtype=FORMAT)
+        if mmap:
+            values = memmap(path, dtype=FORMAT, mode="r", offset=HEADER.size)
+        return cls._from_values(values, degree, count)
+
+    @classmethod
+    def _from_values(cls, values, degree, count):
+        size = count + 1 + count * 3 * (degree + 1)
+        if len(values) < size:
+            raise ValueError("Trajectory data is truncated")
+        breaks = values[:count + 1]
+        coefficients = values[count + 1:size].reshape(count, 3, degree + 1)
+        return cls(breaks, coefficients)
+
+
+def _header(data):
+    magic, version, degree, count = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Not a trajectory file")
+    if version != VERSION:
+        raise ValueError("Unknown trajectory format version %d" % version)
+    return degree, count
+
+
+def _nodes(degree):
+    """
+    Chebyshev nodes for *degree*, and the matrix taking values at them to
+    series coefficients.
+    """
+    n = degree + 1
+    k = arange(n, dtype=_float) + _float("0.5")
+    nodes = cos(pi * k / n)
+    basis = 2 * cos(pi * arange(n)[:, newaxis] * k[newaxis, :] / n) / n
+    basis[0] /= 2
+    return nodes, basis
+
+
+def _checks(nodes):
+    """
+    Points between the nodes (and the segment ends), where the
+    interpolation error is largest.
+    """
+    edges = concatenate([[_float(1)], nodes, [_float(-1)]])
+    middles = (edges[:-1] + edges[1:]) / 2
+    return concatenate([[_float(1)], middles, [_float(-1)]])
+
+
+def _basis(x, degree):
+    """
+    Chebyshev polynomials T_0..T_degree at each of *x*, as (degree + 1, N).
+    """
+    t = empty((degree + 1, len(x)), dtype=_float)
+    t[0] = 1
+    if degree:
+        t[1] = x
+    for j in range(2, degree + 1):
+        t[j] = 2 * x * t[j - 1] - t[j - 2]
+    return t
+
+
+def _clenshaw(coefficients, x):
+    """
+    Sum the series *coefficients* (N, 3, degree + 1) at *x* (N,).
+    """
+    x = x[:, newaxis]
+    b1 = b2 = 0
+    for j in range(coefficients.shape[-1] - 1, 0, -1):
+        b1, b2 = coefficients[:, :, j] + 2 * x * b1 - b2, b1
+    return coefficients[:, :, 0] + x * b1 - b2
+
+
+if __name__ == "__main__":
+    #
+    # Compress the GEO catalogue and compare with storing a state vector
+    # (position and velocity) every second.
+    #
+    import sys
+    import time
+
+    from numpy import linspace
+    from numpy.linalg import norm
+
+    from deltav.physics.body import Body
+    from deltav.physics.orbit import Orbit
+    from deltav.physics.util import load_tle_file
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/celestrak/geo.txt"
+    days = 7
+    duration = days * 86400
+
+    earth = Body(5.972e24, 6371000)
+    size = raw = 0
+    worst = 0
+    elapsed = 0
+    for tle in load_tle_file(path, max=50):
+        body = Body(15000, 10)
+        body.orbit(earth, *Orbit.vecs_from_tle(tle, earth, body))
+        t = time.time()
+        trajectory = Trajectory.from_orbit(body._orbit, duration)
+        elapsed += time.time() - t
+        trajectory = Trajectory.frombytes(trajectory.tobytes())
+
+        times = linspace(0, duration, 997)
+        positions, _ = trajectory.at(times)
+        exact = array([body._orbit.get_position(t)[0] for t in times])
+        worst = max(worst, norm((positions - exact).astype(float), axis=1).max())
+        size += trajectory.nbytes
+        raw += duration * 6 * 8
+
+    print("%d days, %d kB raw, %d kB compressed (%.0fx), worst error %.3g m, %.2fs to fit"
+          % (days, raw // 1024, size // 1024, raw / size, worst, elapsed))
@@ -12,8 +12,11 @@ from .modules import EmptyModule
 from .modules.power import *
 from .modules.weapons import *
 
-from deltav.physics.body import Body
-from deltav.physics.helpers import array, Rx, Ry, Rz
+from deltav.physics.body import Body, KIND_SHIP, KIND_MISSILE, KIND_DEBRIS
+from deltav.physics.helpers import array
+from deltav.physics.rotation import rx, ry, rotate
+from deltav.physics.lambert import first_intercept
+from deltav.configure import logger
 
 #
 # Nothing to see here yet
@@ -22,6 +25,7 @@ from deltav.physics.helpers import array, Rx, Ry, Rz
 
 class BaseShip(Body):
 
+    kind = KIND_SHIP
     base_mass = 15000
 
     def __init__(self, ship_name, radius = 10):
@@ -73,8 +77,7 @@ class BaseShip(Body):
         # accelerate along the current direction
         vec = array([0, dv, 0])
         # FIXME: I think roll is pointless?
-        vec = (Rx(self.pitch)*Ry(self.yaw)).dot(vec[:, numpy.newaxis])
-        vec = numpy.squeeze(numpy.asarray(vec))
+        vec = rotate(rx(self.pitch) @ ry(self.yaw), vec)
         self._orbit.accelerate(vec)
 
 
@@ -100,26 +103,18 @@ class BaseShip(Body):
     def shoot_target(self, shot):
 
         if shot == "bullet":
-            # solve lambert's problem for the new orbit we want to create. we don't
-            # care about the second delta-v, because we aren't rendezvousing
-            t = 10
-            while True:
-                try:
-                    p1, v1 = self._orbit.get_position()
-                    t_orbit = self.target._orbit
-                    t_epoch = t_orbit.t_delta
-                    new_epoch = t_epoch + t
-                    p2, v2 = self.target._orbit.get_position(new_epoch)
-                    new_v, _ = self._orbit.lambert_deltas(p1, v1, p2, v2, t)
-                except ValueError: # invalid orbit for the small t we are attempting
-                    # FIXME: should be a better heuristic for this
-                    t *= 1.1
-                    continue
-                break
+            # solve lambert's problem for the new orbit we want to create, for
+            # every candidate time of flight at once. we don't care about the
+            # second delta-v, because we aren't rendezvousing
+            t, new_v = first_intercept(self._orbit, self.target._orbit)
+            if t is None:
+                logger.debug("%s: no firing solution", self)
+                return None
             # FIXME: check and iterate if delta_v is too high
             #delta_v = abs(v1 - new_v)
             print(self, "time", t)
 
+            p1, _ = self._orbit.get_position()
             bullet = Bullet()
             bullet.orbit(self._orbit.parent, p1, new_v)
 
@@ -225,6 +220,7 @@ class MobShip(BaseShip):
 
 class Missile(BaseShip):
 
+    kind = KIND_MISSILE
     invuln_time = 30
     def __init__(self, name = None):
         super(Missile, self).__init__(name or "(unknown)", 1)
@@ -235,9 +231,15 @@ class Missile(BaseShip):
         if self.destroyed: return
         super(Missile, self).game_tick(dt)
         self.clock += dt
-        if self.destructable == False and self.clock > self.invuln_time:
+        if self.destructable == False and self.clock >= self.invuln_time:
             self.destructable = True
 
+    def next_event(self):
+        events = [super(Missile, self).next_event()]
+        if self.destructable == False:
+            events.append(self.invuln_time - self.clock)
+        return _soonest(events)
+
 
 
 
@@ -253,6 +255,8 @@ class Bullet(Missile):
 
 class Torpedo(Missile):
     base_mass = 145 # kg
+    # Seconds between course corrections
+    correction_time = 100
 
     def __init__(self, target):
         super(Torpedo, self).__init__("MK-1 (G)")
@@ -266,35 +270,34 @@ class Torpedo(Missile):
     def game_tick(self, dt):
         if self.destroyed: return
         super(Torpedo, self).game_tick(dt)
-        if self.clock > 100 and self.adjustments > 0:
+        if self.clock >= self.correction_time and self.adjustments > 0:
             self.adjust_course()
             self.clock = 0
         if self.time_to_impact is not None:
             self.time_to_impact -= dt
 
+    def next_event(self):
+        events = [super(Torpedo, self).next_event()]
+        if self.adjustments > 0:
+            events.append(self.correction_time - self.clock)
+        # Stop at the predicted impact, so the hit is checked right there
+        if self.time_to_impact is not None and self.time_to_impact > 0:
+            events.append(self.time_to_impact)
+        return _soonest(events)
+
     def adjust_course(self):
         # solve lambert's problem for the new orbit we want to create. we don't
         # care about the second delta-v, because we aren't rendezvousing
-        t = 10
-        while True:
-            try:
-                p1, v1 = self._orbit.get_position()
-                t_orbit = self.target._orbit
-                t_epoch = t_orbit.t_delta
-                new_epoch = t_epoch + t
-                p2, v2 = self.target._orbit.get_position(new_epoch)
-                new_v, _ = self._orbit.lambert_deltas(p1, v1, p2, v2, t)
-                # only adjust if new course is faster
-                # FIXME: or if won't intercept
-                if self.time_to_impact is None or abs(self.time_to_impact - t) < 10:
-                    self._orbit.set_veloctiy(new_v)
-                    self.time_to_impact = t
-                    self.adjustments -= 1
-            except ValueError: # invalid orbit for the small t we are attempting
-                # FIXME: should be a better heuristic for this
-                t *= 1.1
-                continue
-            break
+        t, new_v = first_intercept(self._orbit, self.target._orbit)
+        if t is None:
+            logger.debug("%s: no firing solution", self)
+            return
+        # only adjust if new course is faster
+        # FIXME: or if won't intercept
+        if self.time_to_impact is None or abs(self.time_to_impact - t) < 10:
+            self._orbit.set_veloctiy(new_v)
+            self.time_to_impact = t
+            self.adjustments -= 1
         print(self, "time", t)
         # FIXME: this is super imba
     def _destruct_enable(self, dt, *args, **kwargs):
@@ -303,6 +306,7 @@ class Torpedo(Missile):
      
 
 class Debris(Missile):
+    kind = KIND_DEBRIS
     base_mass = 10 # kg
     
     def __init__(self,):
@@ -310,4 +314,9 @@ class Debris(Missile):
     
     def explode(self, *args, **kwargs):
         self.destroyed = True
-        return []
\ No newline at end of file
+        return []
+
+
+def _soonest(events):
+    events = [t for t in events if t is not None]
+    return max(min(events), 0) if events else None
@@ -3,6 +3,8 @@ from setuptools import setup
 setup(
 	name = 'deltav',
     version = '0.0.0',
+    # multiprocessing.shared_memory (deltav.physics.parallel)
+    python_requires = '>=3.8',
     py_modules = [
     	'deltav',
     ],